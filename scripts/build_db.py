@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+"""
+Build dmm.db directly from dioscmatmad_db.xml, skipping the CSV round-trip.
+
+Equivalent to running migrate_db.py followed by import_csv.py, except that
+the migrated rows are inserted straight into SQLite instead of being written
+to data/*.csv and parsed back. editions.csv is not produced by the migration,
+so it is still imported from data/. The canonical CSVs are not touched.
+
+import_csv.py reads the CSVs back with universal newlines, which turns
+carriage returns inside values into newlines; the rows inserted here are
+normalized the same way, so both builders give identical tables (ids
+included) for the same XML.
+
+Usage:
+    python scripts/build_db.py
+"""
+
+import sqlite3
+from pathlib import Path
+
+import import_csv
+import migrate_db
+
+
+def csv_value(value):
+    """Return value as import_csv.py would read it back from a migrated CSV."""
+    if isinstance(value, str) and '\r' in value:
+        return value.replace('\r\n', '\n').replace('\r', '\n')
+    return value
+
+
+def insert_rows(conn, table_name, rows):
+    """Insert row tuples (in TABLE_COLUMNS order) into a table, as import_csv would."""
+    sql = import_csv.insert_sql(table_name, import_csv.TABLE_COLUMNS[table_name])
+    with conn:
+        conn.executemany(sql, (tuple(map(csv_value, row)) for row in rows))
+    return len(rows)
+
+
+def build(xml_path, editions_csv, db_path):
+    """Build db_path from xml_path, with the editions table from editions_csv."""
+    print(f'Parsing {xml_path}...')
+    items = migrate_db.parse_xml(xml_path)
+    print(f'Found {len(items)} items')
+
+    entries, item_ids = migrate_db.extract_entries(items)
+    alignments = migrate_db.extract_alignments(entries, item_ids)
+    identifications, entities = migrate_db.extract_identifications(items, entries)
+
+    conn = import_csv.create_database(db_path)
+
+    print(f'Importing {editions_csv.name}...')
+    count = import_csv.import_csv_to_table(conn, editions_csv, 'editions')
+    print(f'  Imported {count} rows into editions')
+
+    # Same dependency order as import_csv.py
+    tables = [
+        ('entries', entries),
+        ('alignments', alignments),
+        ('entities', entities),
+        ('identifications', identifications),
+        ('manuscripts', migrate_db.MANUSCRIPTS_TEMPLATE),
+        ('witnesses', migrate_db.WITNESSES_TEMPLATE),
+    ]
+    for table_name, rows in tables:
+        try:
+            count = insert_rows(conn, table_name, rows)
+        except sqlite3.Error as e:
+            raise SystemExit(f'Failed to load {table_name}: {e}')
+        print(f'  Imported {count} rows into {table_name}')
+
+    import_csv.finish_database(conn, db_path)
+
+
+def main():
+    # Paths
+    project_dir = Path(__file__).parent.parent
+    data_dir = project_dir / 'data'
+    build(project_dir / 'dioscmatmad_db.xml', data_dir / 'editions.csv', data_dir / 'dmm.db')
+
+
+if __name__ == '__main__':
+    main()
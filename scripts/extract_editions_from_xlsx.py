@@ -23,8 +23,13 @@ from __future__ import annotations
 
 import argparse
 import csv
+import re
+import string
 import zipfile
-from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import ExitStack
+from dataclasses import dataclass
+from functools import partial
 from pathlib import Path
 from typing import Iterable
 from xml.etree import ElementTree as ET
@@ -33,6 +38,14 @@ from xml.etree import ElementTree as ET
 NS_MAIN = {"m": "http://schemas.openxmlformats.org/spreadsheetml/2006/main"}
 REL_NS = "{http://schemas.openxmlformats.org/package/2006/relationships}"
 R_ID = "{http://schemas.openxmlformats.org/officeDocument/2006/relationships}id"
+CELL_TAG = "{%s}c" % NS_MAIN["m"]
+ROW_TAG = "{%s}row" % NS_MAIN["m"]
+SI_TAG = "{%s}si" % NS_MAIN["m"]
+T_TAG = "{%s}t" % NS_MAIN["m"]
+V_TAG = "{%s}v" % NS_MAIN["m"]
+
+# Edition CSVs are well under 1 MiB, so each is flushed to disk in a single write.
+WRITE_BUFFER_SIZE = 1 << 20
 
 
 def _col_to_int(col: str) -> int:
@@ -42,18 +55,35 @@ def _col_to_int(col: str) -> int:
     return n
 
 
+CELL_REF_RE = re.compile(r"([A-Z]+)(\d+)")
+
+# Column letters A..ZZ (702 columns) cover every sheet we read; wider columns are
+# added on first sight, so _col_to_int runs at most once per distinct column.
+_COL_LUT: dict[str, int] = {
+    col: _col_to_int(col)
+    for col in list(string.ascii_uppercase)
+    + [a + b for a in string.ascii_uppercase for b in string.ascii_uppercase]
+}
+
+
 def _split_ref(cell_ref: str) -> tuple[int, int]:
-    col = "".join([c for c in cell_ref if c.isalpha()])
-    row = int("".join([c for c in cell_ref if c.isdigit()]))
-    return _col_to_int(col), row
+    m = CELL_REF_RE.match(cell_ref)
+    if m is None:
+        raise ValueError(f"Unexpected cell reference: {cell_ref!r}")
+    col, row = m.groups()
+    col_num = _COL_LUT.get(col)
+    if col_num is None:
+        # Wider than ZZ: compute once, then serve from the table like the rest.
+        col_num = _COL_LUT[col] = _col_to_int(col)
+    return col_num, int(row)
 
 
 def _normalize(value: str) -> str:
-    v = str(value).strip()
-    if v.upper() == "#N/A":
+    v = value.strip()
+    if not v or (v[0] == "#" and v.upper() == "#N/A"):
         return ""
-    # trim float-ish integers like "17.0" -> "17"
-    if v.endswith(".0") and v.replace(".", "", 1).isdigit():
+    # trim float-ish integers like "17.0" -> "17"; a bare ".0" becomes "", as before
+    if v[-2:] == ".0" and (v[:-2].isdigit() or len(v) == 2):
         return v[:-2]
     return v
 
@@ -62,7 +92,7 @@ class XlsxReader:
     def __init__(self, path: Path):
         self.path = path
         self._zip = zipfile.ZipFile(path)
-        self._shared_strings = self._load_shared_strings()
+        self._shared_strings = tuple(self._load_shared_strings())
         self._sheet_targets = self._load_sheet_targets()
 
     def close(self) -> None:
@@ -71,16 +101,21 @@ class XlsxReader:
     def _load_shared_strings(self) -> list[str]:
         if "xl/sharedStrings.xml" not in self._zip.namelist():
             return []
-        root = ET.fromstring(self._zip.read("xl/sharedStrings.xml"))
         shared: list[str] = []
-        for si in root.findall("m:si", NS_MAIN):
-            texts = [(t.text or "") for t in si.findall(".//m:t", NS_MAIN)]
-            shared.append("".join(texts))
+        # Stream <si> items rather than holding the whole string table as a DOM.
+        with self._zip.open("xl/sharedStrings.xml") as fp:
+            for _, si in ET.iterparse(fp):
+                if si.tag != SI_TAG:
+                    continue
+                shared.append("".join((t.text or "") for t in si.iter(T_TAG)))
+                si.clear()
         return shared
 
     def _load_sheet_targets(self) -> dict[str, str]:
-        wb = ET.fromstring(self._zip.read("xl/workbook.xml"))
-        rels = ET.fromstring(self._zip.read("xl/_rels/workbook.xml.rels"))
+        with self._zip.open("xl/workbook.xml") as fp:
+            wb = ET.parse(fp).getroot()
+        with self._zip.open("xl/_rels/workbook.xml.rels") as fp:
+            rels = ET.parse(fp).getroot()
         rid_to_target = {
             rel.attrib["Id"]: rel.attrib["Target"]
             for rel in rels.findall(f"{REL_NS}Relationship")
@@ -92,326 +127,258 @@ class XlsxReader:
 
     def iter_rows(self, sheet: str) -> Iterable[tuple[int, dict[int, str]]]:
         target = self._sheet_targets[sheet]
-        root = ET.fromstring(self._zip.read("xl/" + target.lstrip("/")))
-
-        rows: dict[int, dict[int, str]] = defaultdict(dict)
-        for c in root.findall(".//m:sheetData/m:row/m:c", NS_MAIN):
-            ref = c.attrib.get("r")
-            if not ref:
-                continue
-            col, row = _split_ref(ref)
-
-            value = ""
-            cell_type = c.attrib.get("t")
-            if cell_type == "inlineStr":
-                t = c.find(".//m:t", NS_MAIN)
-                value = t.text if t is not None and t.text is not None else ""
-            else:
-                v = c.find("m:v", NS_MAIN)
-                if v is None or v.text is None:
-                    continue
-                if cell_type == "s":
-                    try:
-                        value = self._shared_strings[int(v.text)]
-                    except Exception:
-                        value = v.text
-                else:
-                    value = v.text
-
-            value = _normalize(value)
-            if value == "":
-                continue
-            rows[row][col] = value
 
-        for r in sorted(rows.keys()):
-            yield r, rows[r]
-
-
-def _write_csv(path: Path, fieldnames: list[str], rows: list[dict[str, str]]) -> None:
-    path.parent.mkdir(parents=True, exist_ok=True)
-    with path.open("w", newline="", encoding="utf-8") as f:
-        w = csv.DictWriter(f, fieldnames=fieldnames, extrasaction="ignore")
-        w.writeheader()
-        w.writerows(rows)
+        # Hot loop: bind everything it touches per cell to locals.
+        shared_strings = self._shared_strings
+        split_ref = _split_ref
+        normalize = _normalize
+        # Stream <c> elements as they close instead of building the full sheet DOM.
+        # The spec requires <row> elements in ascending order, so each row is
+        # yielded (and cleared) as soon as it closes; empty rows are skipped.
+        cells: dict[int, str] = {}
+        row_num = 0
+        with self._zip.open("xl/" + target.lstrip("/")) as fp:
+            for _, c in ET.iterparse(fp):
+                tag = c.tag
+                if tag == ROW_TAG:
+                    c.clear()
+                    if cells:
+                        yield row_num, cells
+                        cells = {}
+                    continue
+                if tag != CELL_TAG:
+                    continue
+                attrib = c.attrib
+                ref = attrib.get("r")
+                if not ref:
+                    continue
+                col, row_num = split_ref(ref)
 
+                value = ""
+                cell_type = attrib.get("t")
+                if cell_type == "inlineStr":
+                    t = next(c.iter(T_TAG), None)
+                    value = t.text if t is not None and t.text is not None else ""
+                else:
+                    v = c.find(V_TAG)
+                    if v is None or v.text is None:
+                        continue
+                    if cell_type == "s":
+                        # An out-of-range index means a corrupt workbook; let it raise.
+                        value = shared_strings[int(v.text)]
+                    else:
+                        value = v.text
 
-def extract(xlsx_path: Path, out_dir: Path) -> None:
+                value = normalize(value)
+                if value == "":
+                    continue
+                cells[col] = value
+
+
+@dataclass(frozen=True)
+class EditionSheet:
+    sheet: str
+    edition: str
+    outputs: tuple[str, ...]
+    has_header: bool
+    # (output column, 1-based worksheet column), in output order
+    columns: tuple[tuple[str, int], ...]
+
+
+EDITION_SHEETS: tuple[EditionSheet, ...] = (
+    # berendes (no header; 3 columns)
+    EditionSheet(
+        "berendes",
+        "berendes",
+        ("berendes.csv",),
+        False,
+        (("berendes_teitok_id", 1), ("berendes_chapter", 2), ("berendes_term", 3)),
+    ),
+    # moulins (has header); also kept under its raw sheet name
+    EditionSheet(
+        "moulins",
+        "desmoulins",
+        ("desmoulins.csv", "moulins.csv"),
+        True,
+        (("desmoulins_page", 1), ("desmoulins_chapter", 3), ("desmoulins_term", 2)),
+    ),
+    # laguna (has header row)
+    EditionSheet(
+        "laguna",
+        "laguna",
+        ("laguna.csv",),
+        True,
+        (
+            ("laguna_scan_id", 1),
+            ("laguna_book", 2),
+            ("laguna_page", 3),
+            ("laguna_chapter", 4),
+            ("laguna_title", 5),
+        ),
+    ),
+    # wechel (has header row)
+    EditionSheet(
+        "wechel",
+        "wechel",
+        ("wechel.csv",),
+        True,
+        (
+            ("wechel_scan_id", 1),
+            ("wechel_book", 2),
+            ("wechel_page", 3),
+            ("wechel_chapter", 5),
+            ("wechel_title", 4),
+        ),
+    ),
+    # ruel (no header; 6 columns)
+    EditionSheet(
+        "ruel",
+        "ruel",
+        ("ruel.csv",),
+        False,
+        (
+            ("ruel_page_scan", 1),
+            ("ruel_book", 2),
+            ("ruel_unknown_val", 3),
+            ("ruel_chapter", 4),
+            ("ruel_title_latin", 5),
+            ("ruel_folio", 6),
+        ),
+    ),
+    # lusitanus (no header; usually 3 columns: page, title, note)
+    EditionSheet(
+        "lusitanus",
+        "lusitanus",
+        ("lusitanus.csv",),
+        False,
+        (("lusitanus_page", 1), ("lusitanus_title", 2), ("lusitanus_note", 3)),
+    ),
+    # barbaro (no header; 4 columns)
+    EditionSheet(
+        "barbaro",
+        "barbaro",
+        ("barbaro.csv",),
+        False,
+        (("barbaro_page", 1), ("barbaro_book", 4), ("barbaro_chapter", 2), ("barbaro_term", 3)),
+    ),
+    # gunther (no header; 4 columns)
+    EditionSheet(
+        "gunther",
+        "gunther",
+        ("gunther.csv",),
+        False,
+        (
+            ("gunther_chapter", 1),
+            ("gunther_division", 2),
+            ("gunther_term", 3),
+            ("gunther_description", 4),
+        ),
+    ),
+    # matthiolo (no header; 4 columns in early rows, but later may extend)
+    EditionSheet(
+        "matthiolo",
+        "matthiolo",
+        ("matthiolo.csv",),
+        False,
+        (
+            ("matthiolo_book", 1),
+            ("matthiolo_chapter", 2),
+            ("matthiolo_greek", 3),
+            ("matthiolo_latin", 4),
+        ),
+    ),
+    # wellmann (no header; 4 columns)
+    EditionSheet(
+        "wellmann",
+        "wellmann",
+        ("wellmann.csv",),
+        False,
+        (
+            ("wellmann_id", 1),
+            ("wellmann_book", 2),
+            ("wellmann_chapter", 3),
+            ("wellmann_greek_text", 4),
+        ),
+    ),
+    # beck-index (no header; 3 columns)
+    EditionSheet(
+        "beck-index",
+        "beck",
+        ("beck_index.csv",),
+        False,
+        (("dmm_id", 1), ("greek_lemma", 2), ("latin_lemma", 3)),
+    ),
+)
+
+
+def _write_edition(reader: XlsxReader, spec: EditionSheet, out_dir: Path) -> None:
+    """Stream one worksheet straight into its edition CSV(s), row by row."""
+    header = ["edition", "edition_entry_id"] + [name for name, _ in spec.columns]
+    col_indices = [idx for _, idx in spec.columns]
+
+    out_dir.mkdir(parents=True, exist_ok=True)
+    with ExitStack() as stack:
+        writers = []
+        for name in spec.outputs:
+            f = stack.enter_context(
+                (out_dir / name).open(
+                    "w", newline="", encoding="utf-8", buffering=WRITE_BUFFER_SIZE
+                )
+            )
+            w = csv.writer(f)
+            w.writerow(header)
+            writers.append(w)
+
+        rows = iter(reader.iter_rows(spec.sheet))
+        if spec.has_header:
+            next(rows, None)
+        # One shared edition string per sheet; rows are plain lists, so there are
+        # no per-row dict keys to hash or intern.
+        edition = spec.edition
+        for row_idx, cells in rows:
+            record = [edition, f"row{row_idx}"]
+            # iter_rows already normalized every cell value
+            record.extend(cells.get(idx, "") for idx in col_indices)
+            for w in writers:
+                w.writerow(record)
+
+
+def _extract_sheet(spec: EditionSheet, xlsx_path: Path, out_dir: Path) -> None:
+    # Each task opens its own reader (ZipFile handles are not picklable) and
+    # closes it before the worker takes the next sheet.
     reader = XlsxReader(xlsx_path)
     try:
-        # berendes (no header; 3 columns)
-        ber: list[dict[str, str]] = []
-        for row_idx, cells in reader.iter_rows("berendes"):
-            ber.append(
-                {
-                    "edition": "berendes",
-                    "edition_entry_id": f"row{row_idx}",
-                    "berendes_teitok_id": _normalize(cells.get(1, "")),
-                    "berendes_chapter": _normalize(cells.get(2, "")),
-                    "berendes_term": _normalize(cells.get(3, "")),
-                }
-            )
-        _write_csv(
-            out_dir / "berendes.csv",
-            ["edition", "edition_entry_id", "berendes_teitok_id", "berendes_chapter", "berendes_term"],
-            ber,
-        )
-
-        # moulins (has header)
-        moul: list[dict[str, str]] = []
-        # Read header row explicitly from iter_rows
-        raw_rows = list(reader.iter_rows("moulins"))
-        header = {col: val for col, val in raw_rows[0][1].items()}
-        for row_idx, cells in raw_rows[1:]:
-            moul.append(
-                {
-                    "edition": "desmoulins",
-                    "edition_entry_id": f"row{row_idx}",
-                    "desmoulins_page": _normalize(cells.get(1, "")),
-                    "desmoulins_term": _normalize(cells.get(2, "")),
-                    "desmoulins_chapter": _normalize(cells.get(3, "")),
-                }
-            )
-        _write_csv(
-            out_dir / "desmoulins.csv",
-            ["edition", "edition_entry_id", "desmoulins_page", "desmoulins_chapter", "desmoulins_term"],
-            moul,
-        )
-        _write_csv(
-            out_dir / "moulins.csv",
-            ["edition", "edition_entry_id", "desmoulins_page", "desmoulins_chapter", "desmoulins_term"],
-            moul,
-        )
-
-        # laguna (has header row)
-        lag: list[dict[str, str]] = []
-        raw_rows = list(reader.iter_rows("laguna"))
-        # skip header
-        for row_idx, cells in raw_rows[1:]:
-            lag.append(
-                {
-                    "edition": "laguna",
-                    "edition_entry_id": f"row{row_idx}",
-                    "laguna_scan_id": _normalize(cells.get(1, "")),
-                    "laguna_book": _normalize(cells.get(2, "")),
-                    "laguna_page": _normalize(cells.get(3, "")),
-                    "laguna_chapter": _normalize(cells.get(4, "")),
-                    "laguna_title": _normalize(cells.get(5, "")),
-                }
-            )
-        _write_csv(
-            out_dir / "laguna.csv",
-            [
-                "edition",
-                "edition_entry_id",
-                "laguna_scan_id",
-                "laguna_book",
-                "laguna_page",
-                "laguna_chapter",
-                "laguna_title",
-            ],
-            lag,
-        )
-
-        # wechel (has header row)
-        wec: list[dict[str, str]] = []
-        raw_rows = list(reader.iter_rows("wechel"))
-        for row_idx, cells in raw_rows[1:]:
-            wec.append(
-                {
-                    "edition": "wechel",
-                    "edition_entry_id": f"row{row_idx}",
-                    "wechel_scan_id": _normalize(cells.get(1, "")),
-                    "wechel_book": _normalize(cells.get(2, "")),
-                    "wechel_page": _normalize(cells.get(3, "")),
-                    "wechel_title": _normalize(cells.get(4, "")),
-                    "wechel_chapter": _normalize(cells.get(5, "")),
-                }
-            )
-        _write_csv(
-            out_dir / "wechel.csv",
-            [
-                "edition",
-                "edition_entry_id",
-                "wechel_scan_id",
-                "wechel_book",
-                "wechel_page",
-                "wechel_chapter",
-                "wechel_title",
-            ],
-            wec,
-        )
-
-        # ruel (no header; 6 columns)
-        ruel: list[dict[str, str]] = []
-        for row_idx, cells in reader.iter_rows("ruel"):
-            ruel.append(
-                {
-                    "edition": "ruel",
-                    "edition_entry_id": f"row{row_idx}",
-                    "ruel_page_scan": _normalize(cells.get(1, "")),
-                    "ruel_book": _normalize(cells.get(2, "")),
-                    "ruel_unknown_val": _normalize(cells.get(3, "")),
-                    "ruel_chapter": _normalize(cells.get(4, "")),
-                    "ruel_title_latin": _normalize(cells.get(5, "")),
-                    "ruel_folio": _normalize(cells.get(6, "")),
-                }
-            )
-        _write_csv(
-            out_dir / "ruel.csv",
-            [
-                "edition",
-                "edition_entry_id",
-                "ruel_page_scan",
-                "ruel_book",
-                "ruel_unknown_val",
-                "ruel_chapter",
-                "ruel_title_latin",
-                "ruel_folio",
-            ],
-            ruel,
-        )
-
-        # lusitanus (no header; usually 3 columns: page, title, note)
-        lus: list[dict[str, str]] = []
-        for row_idx, cells in reader.iter_rows("lusitanus"):
-            lus.append(
-                {
-                    "edition": "lusitanus",
-                    "edition_entry_id": f"row{row_idx}",
-                    "lusitanus_page": _normalize(cells.get(1, "")),
-                    "lusitanus_title": _normalize(cells.get(2, "")),
-                    "lusitanus_note": _normalize(cells.get(3, "")),
-                }
-            )
-        _write_csv(
-            out_dir / "lusitanus.csv",
-            ["edition", "edition_entry_id", "lusitanus_page", "lusitanus_title", "lusitanus_note"],
-            lus,
-        )
-
-        # barbaro (no header; 4 columns)
-        bar: list[dict[str, str]] = []
-        for row_idx, cells in reader.iter_rows("barbaro"):
-            bar.append(
-                {
-                    "edition": "barbaro",
-                    "edition_entry_id": f"row{row_idx}",
-                    "barbaro_page": _normalize(cells.get(1, "")),
-                    "barbaro_chapter": _normalize(cells.get(2, "")),
-                    "barbaro_term": _normalize(cells.get(3, "")),
-                    "barbaro_book": _normalize(cells.get(4, "")),
-                }
-            )
-        _write_csv(
-            out_dir / "barbaro.csv",
-            ["edition", "edition_entry_id", "barbaro_page", "barbaro_book", "barbaro_chapter", "barbaro_term"],
-            bar,
-        )
-
-        # gunther (no header; 4 columns)
-        gun: list[dict[str, str]] = []
-        for row_idx, cells in reader.iter_rows("gunther"):
-            gun.append(
-                {
-                    "edition": "gunther",
-                    "edition_entry_id": f"row{row_idx}",
-                    "gunther_chapter": _normalize(cells.get(1, "")),
-                    "gunther_division": _normalize(cells.get(2, "")),
-                    "gunther_term": _normalize(cells.get(3, "")),
-                    "gunther_description": _normalize(cells.get(4, "")),
-                }
-            )
-        _write_csv(
-            out_dir / "gunther.csv",
-            [
-                "edition",
-                "edition_entry_id",
-                "gunther_chapter",
-                "gunther_division",
-                "gunther_term",
-                "gunther_description",
-            ],
-            gun,
-        )
-
-        # matthiolo (no header; 4 columns in early rows, but later may extend)
-        mat: list[dict[str, str]] = []
-        for row_idx, cells in reader.iter_rows("matthiolo"):
-            mat.append(
-                {
-                    "edition": "matthiolo",
-                    "edition_entry_id": f"row{row_idx}",
-                    "matthiolo_book": _normalize(cells.get(1, "")),
-                    "matthiolo_chapter": _normalize(cells.get(2, "")),
-                    "matthiolo_greek": _normalize(cells.get(3, "")),
-                    "matthiolo_latin": _normalize(cells.get(4, "")),
-                }
-            )
-        _write_csv(
-            out_dir / "matthiolo.csv",
-            [
-                "edition",
-                "edition_entry_id",
-                "matthiolo_book",
-                "matthiolo_chapter",
-                "matthiolo_greek",
-                "matthiolo_latin",
-            ],
-            mat,
-        )
-
-        # wellmann (no header; 4 columns)
-        wel: list[dict[str, str]] = []
-        for row_idx, cells in reader.iter_rows("wellmann"):
-            wel.append(
-                {
-                    "edition": "wellmann",
-                    "edition_entry_id": f"row{row_idx}",
-                    "wellmann_id": _normalize(cells.get(1, "")),
-                    "wellmann_book": _normalize(cells.get(2, "")),
-                    "wellmann_chapter": _normalize(cells.get(3, "")),
-                    "wellmann_greek_text": _normalize(cells.get(4, "")),
-                }
-            )
-        _write_csv(
-            out_dir / "wellmann.csv",
-            [
-                "edition",
-                "edition_entry_id",
-                "wellmann_id",
-                "wellmann_book",
-                "wellmann_chapter",
-                "wellmann_greek_text",
-            ],
-            wel,
-        )
-
-        # beck-index (no header; 3 columns)
-        beck: list[dict[str, str]] = []
-        for row_idx, cells in reader.iter_rows("beck-index"):
-            beck.append(
-                {
-                    "edition": "beck",
-                    "edition_entry_id": f"row{row_idx}",
-                    "dmm_id": _normalize(cells.get(1, "")),
-                    "greek_lemma": _normalize(cells.get(2, "")),
-                    "latin_lemma": _normalize(cells.get(3, "")),
-                }
-            )
-        _write_csv(
-            out_dir / "beck_index.csv",
-            ["edition", "edition_entry_id", "dmm_id", "greek_lemma", "latin_lemma"],
-            beck,
-        )
-
+        _write_edition(reader, spec, out_dir)
     finally:
         reader.close()
 
 
+def extract(xlsx_path: Path, out_dir: Path, jobs: int = 1) -> None:
+    if jobs <= 1:
+        reader = XlsxReader(xlsx_path)
+        try:
+            for spec in EDITION_SHEETS:
+                _write_edition(reader, spec, out_dir)
+        finally:
+            reader.close()
+        return
+
+    # Sheets are independent and each writes its own files, so output is identical
+    # to the serial path regardless of completion order.
+    with ProcessPoolExecutor(max_workers=jobs) as ex:
+        list(ex.map(partial(_extract_sheet, xlsx_path=xlsx_path, out_dir=out_dir), EDITION_SHEETS))
+
+
 def main() -> int:
     parser = argparse.ArgumentParser(description="Extract per-edition CSVs from Materia Medica.xlsx")
     parser.add_argument("--xlsx", default="Materia Medica.xlsx", help="Input .xlsx path")
     parser.add_argument("--out-dir", default="data/editions", help="Output directory")
+    parser.add_argument(
+        "--jobs",
+        type=int,
+        default=1,
+        help="Worker processes for per-sheet extraction (1 = serial)",
+    )
     args = parser.parse_args()
 
     xlsx_path = Path(args.xlsx)
@@ -419,7 +386,7 @@ def main() -> int:
     if not xlsx_path.exists():
         raise SystemExit(f"Input not found: {xlsx_path}")
 
-    extract(xlsx_path, out_dir)
+    extract(xlsx_path, out_dir, jobs=args.jobs)
     print(f"Wrote edition CSVs to {out_dir}/")
     return 0
 
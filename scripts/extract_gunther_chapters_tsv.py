@@ -31,13 +31,14 @@ import csv
 import re
 import sys
 import xml.etree.ElementTree as ET
-from dataclasses import dataclass
 from pathlib import Path
-from typing import Iterable, Optional
+from typing import Iterable, Iterator, NamedTuple, Optional
 
 
 CHAPTER_NUM_RE = re.compile(r"^\s*(\d+)\.\s*$")
 HAS_ALNUM_RE = re.compile(r"[0-9A-Za-z]")
+HAS_LOWER_RE = re.compile(r"[a-z]")
+HAS_UPPER_RE = re.compile(r"[A-Z]")
 
 
 def normalize_ws(text: str) -> str:
@@ -48,31 +49,53 @@ def has_alnum(text: str) -> bool:
     return bool(HAS_ALNUM_RE.search(text))
 
 
+def elem_has_alnum(elem: ET.Element) -> bool:
+    """Like has_alnum("".join(elem.itertext())), but stops at the first hit."""
+    return any(HAS_ALNUM_RE.search(text) for text in elem.itertext())
+
+
 def is_probable_chapter_title(title: str) -> bool:
     """
     Gunther chapter titles (Greek terms) are overwhelmingly ALL CAPS.
     Use this to filter out numbered lists inside chapter prose.
     """
 
-    title = normalize_ws(title).strip()
+    title = normalize_ws(title)
     if not title:
         return False
 
-    # Allow spaces and common punctuation in transliteration.
-    if re.search(r"[a-z]", title):
+    # Allow spaces and common punctuation in transliteration. For ASCII titles
+    # (nearly all of them) str.isupper() is exactly "no a-z and at least one A-Z".
+    if title.isascii():
+        return title.isupper()
+
+    # Only ASCII letters count, so e.g. lowercase diacritics don't disqualify a title.
+    if HAS_LOWER_RE.search(title):
         return False
 
-    return bool(re.search(r"[A-Z]", title))
+    return bool(HAS_UPPER_RE.search(title))
+
 
+def load_csv_chapter_refs(csv_path: Path) -> frozenset[tuple[int, int]]:
+    """
+    Return the (book, chapter) pairs listed in the CSV's "gunther_chapter" column.
+
+    Values are "B.C" refs; anything else cannot match an extracted chapter and is skipped.
+    """
 
-def load_csv_chapter_refs(csv_path: Path) -> set[str]:
     with csv_path.open(newline="", encoding="utf-8") as f:
         reader = csv.DictReader(f)
         if "gunther_chapter" not in (reader.fieldnames or []):
             raise ValueError(
                 f'Expected "gunther_chapter" column in {csv_path}, found {reader.fieldnames}'
             )
-        return {row["gunther_chapter"].strip() for row in reader if row.get("gunther_chapter")}
+
+        refs: set[tuple[int, int]] = set()
+        for row in reader:
+            book_raw, sep, chapter_raw = (row.get("gunther_chapter") or "").strip().partition(".")
+            if sep and book_raw.isdigit() and chapter_raw.isdigit():
+                refs.add((int(book_raw), int(chapter_raw)))
+        return frozenset(refs)
 
 
 def load_chapter_overrides_tsv(tsv_path: Path) -> dict[tuple[int, int], tuple[str, str]]:
@@ -121,7 +144,7 @@ def find_chapter_number_hi(p_elem: ET.Element) -> tuple[Optional[int], Optional[
                 return int(m.group(1)), child
 
         # If we hit substantive text before the numeric <hi>, this isn't a heading.
-        if has_alnum("".join(child.itertext())):
+        if elem_has_alnum(child):
             return None, None
 
     return None, None
@@ -203,21 +226,32 @@ def is_description_paragraph_candidate(p_elem: ET.Element) -> Optional[str]:
     return text
 
 
-@dataclass(frozen=True)
-class ChapterRow:
+class ChapterRow(NamedTuple):
     book: int
     chapter: int
     title: str
     description: str
 
-    @property
-    def ref(self) -> str:
-        return f"{self.book}.{self.chapter}"
+
+def iter_paragraphs_with_siblings(
+    elem: ET.Element,
+) -> Iterator[tuple[ET.Element, list[ET.Element], int]]:
+    """
+    Yield (p, siblings, index) for every <p> below elem, in document order.
+
+    Carrying the parent's child list down the walk lets callers look at the
+    following siblings without building a child->parent map for the whole tree.
+    """
+
+    children = list(elem)
+    for idx, child in enumerate(children):
+        if child.tag == "p":
+            yield child, children, idx
+        yield from iter_paragraphs_with_siblings(child)
 
 
 def iter_gunther_chapters(xml_path: Path) -> Iterable[ChapterRow]:
     root = ET.parse(xml_path).getroot()
-    parent_map = {child: parent for parent in root.iter() for child in parent}
 
     for book_div in root.findall('.//div[@type="book"]'):
         book_raw = (book_div.attrib.get("n") or "").strip()
@@ -226,7 +260,7 @@ def iter_gunther_chapters(xml_path: Path) -> Iterable[ChapterRow]:
         book = int(book_raw)
 
         seen_in_book: set[int] = set()
-        for p in book_div.iter("p"):
+        for p, siblings, idx in iter_paragraphs_with_siblings(book_div):
             chapter_num, number_hi = find_chapter_number_hi(p)
             if chapter_num is None or number_hi is None:
                 continue
@@ -240,23 +274,14 @@ def iter_gunther_chapters(xml_path: Path) -> Iterable[ChapterRow]:
             title, desc = split_title_desc(after)
 
             if not desc:
-                parent = parent_map.get(p)
-                if parent is not None:
-                    siblings = list(parent)
-                    try:
-                        idx = siblings.index(p)
-                    except ValueError:
-                        idx = -1
-
-                    if idx >= 0:
-                        for sib in siblings[idx + 1 :]:
-                            if sib.tag != "p":
-                                # Skip over non-paragraph elements between heading and gloss (rare).
-                                continue
-                            candidate = is_description_paragraph_candidate(sib)
-                            if candidate:
-                                desc = candidate
-                            break
+                for sib in siblings[idx + 1 :]:
+                    if sib.tag != "p":
+                        # Skip over non-paragraph elements between heading and gloss (rare).
+                        continue
+                    candidate = is_description_paragraph_candidate(sib)
+                    if candidate:
+                        desc = candidate
+                    break
 
             yield ChapterRow(
                 book=book,
@@ -266,11 +291,36 @@ def iter_gunther_chapters(xml_path: Path) -> Iterable[ChapterRow]:
             )
 
 
-def write_tsv(rows: Iterable[ChapterRow], out_file) -> None:
+def apply_overrides(
+    rows: Iterable[ChapterRow],
+    overrides: dict[tuple[int, int], tuple[str, str]],
+    stats: dict[str, int],
+) -> Iterator[ChapterRow]:
+    """Yield rows with overridden title/description; counts hits in stats["applied"]."""
+    for row in rows:
+        key = (row.book, row.chapter)
+        if key not in overrides:
+            yield row
+            continue
+
+        override_title, override_desc = overrides[key]
+        yield ChapterRow(
+            book=row.book,
+            chapter=row.chapter,
+            title=override_title or row.title,
+            description=override_desc or row.description,
+        )
+        stats["applied"] += 1
+
+
+def write_tsv(rows: Iterable[ChapterRow], out_file) -> int:
     writer = csv.writer(out_file, delimiter="\t", lineterminator="\n")
     writer.writerow(["book", "chapter", "chapter_title", "chapter_description"])
+    count = 0
     for row in rows:
         writer.writerow([row.book, row.chapter, row.title, row.description])
+        count += 1
+    return count
 
 
 def main(argv: list[str]) -> int:
@@ -300,53 +350,41 @@ def main(argv: list[str]) -> int:
         print(f"XML not found: {args.xml}", file=sys.stderr)
         return 2
 
-    rows = list(iter_gunther_chapters(args.xml))
-
+    # Validate and load side inputs up front so the chapter stream can be
+    # filtered and written in a single pass.
+    overrides: Optional[dict[tuple[int, int], tuple[str, str]]] = None
     if args.overrides_tsv:
         if not args.overrides_tsv.exists():
             print(f"Overrides TSV not found: {args.overrides_tsv}", file=sys.stderr)
             return 2
         overrides = load_chapter_overrides_tsv(args.overrides_tsv)
-        applied = 0
-        new_rows: list[ChapterRow] = []
-        for row in rows:
-            key = (row.book, row.chapter)
-            if key not in overrides:
-                new_rows.append(row)
-                continue
-
-            override_title, override_desc = overrides[key]
-            new_rows.append(
-                ChapterRow(
-                    book=row.book,
-                    chapter=row.chapter,
-                    title=override_title or row.title,
-                    description=override_desc or row.description,
-                )
-            )
-            applied += 1
-
-        rows = new_rows
-        print(f"Applied {applied} overrides", file=sys.stderr)
-
-    if not args.no_title_filter:
-        rows = [row for row in rows if is_probable_chapter_title(row.title)]
 
+    existing: Optional[frozenset[tuple[int, int]]] = None
     if args.missing_from:
         if not args.missing_from.exists():
             print(f"CSV not found: {args.missing_from}", file=sys.stderr)
             return 2
         existing = load_csv_chapter_refs(args.missing_from)
-        rows = [row for row in rows if row.ref not in existing]
+
+    rows: Iterable[ChapterRow] = iter_gunther_chapters(args.xml)
+    stats = {"applied": 0}
+    if overrides is not None:
+        rows = apply_overrides(rows, overrides, stats)
+    if not args.no_title_filter:
+        rows = (row for row in rows if is_probable_chapter_title(row.title))
+    if existing is not None:
+        rows = (row for row in rows if (row.book, row.chapter) not in existing)
 
     if args.out:
         args.out.parent.mkdir(parents=True, exist_ok=True)
         with args.out.open("w", encoding="utf-8", newline="") as f:
-            write_tsv(rows, f)
+            written = write_tsv(rows, f)
     else:
-        write_tsv(rows, sys.stdout)
+        written = write_tsv(rows, sys.stdout)
 
-    print(f"Wrote {len(rows)} rows", file=sys.stderr)
+    if overrides is not None:
+        print(f"Applied {stats['applied']} overrides", file=sys.stderr)
+    print(f"Wrote {written} rows", file=sys.stderr)
     return 0
 
 
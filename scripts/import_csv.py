@@ -9,11 +9,16 @@ Usage:
 """
 
 import csv
+import itertools
+import operator
 import sqlite3
+from collections import defaultdict
 from pathlib import Path
 
-# Database schema
-SCHEMA = """
+# Database schema. Tables are created before the bulk load; indexes and views
+# (SCHEMA_INDEXES) afterwards, so each index is built once over the loaded rows
+# instead of being updated on every insert.
+SCHEMA_TABLES = """
 -- Editions table (static reference)
 CREATE TABLE IF NOT EXISTS editions (
     id TEXT PRIMARY KEY,        -- wellmann, laguna, beck...
@@ -47,8 +52,8 @@ CREATE TABLE IF NOT EXISTS alignments (
     entry_b TEXT REFERENCES entries(id),
     alignment_type TEXT,        -- "equivalent", "contains", "part_of", "related"
     confidence TEXT,            -- "certain", "probable", "uncertain"
-    notes TEXT,
-    UNIQUE(entry_a, entry_b)
+    notes TEXT
+    -- UNIQUE(entry_a, entry_b): idx_alignments_unique, built after the load
 );
 
 -- Entities table (botanical/natural things)
@@ -67,8 +72,8 @@ CREATE TABLE IF NOT EXISTS identifications (
     entry_id TEXT REFERENCES entries(id),
     entity_id TEXT REFERENCES entities(id),
     confidence TEXT,            -- certain, probable, uncertain
-    notes TEXT,
-    UNIQUE(entry_id, entity_id)
+    notes TEXT
+    -- UNIQUE(entry_id, entity_id): idx_identifications_unique, built after the load
 );
 
 -- Manuscripts table (physical witnesses)
@@ -94,9 +99,17 @@ CREATE TABLE IF NOT EXISTS witnesses (
     reading TEXT,               -- the text as it appears in this ms
     iiif_canvas TEXT,           -- direct link to IIIF canvas
     iiif_region TEXT,           -- xywh coordinates for the passage
-    apparatus_note TEXT,        -- critical apparatus info
-    UNIQUE(entry_id, manuscript_id)
+    apparatus_note TEXT         -- critical apparatus info
+    -- UNIQUE(entry_id, manuscript_id): idx_witnesses_unique, built after the load
 );
+"""
+
+# Indexes and views, created after the bulk load
+SCHEMA_INDEXES = """
+-- Uniqueness of link rows, enforced once the data is in; fails on duplicates
+CREATE UNIQUE INDEX IF NOT EXISTS idx_alignments_unique ON alignments(entry_a, entry_b);
+CREATE UNIQUE INDEX IF NOT EXISTS idx_identifications_unique ON identifications(entry_id, entity_id);
+CREATE UNIQUE INDEX IF NOT EXISTS idx_witnesses_unique ON witnesses(entry_id, manuscript_id);
 
 -- Create indexes for common queries
 CREATE INDEX IF NOT EXISTS idx_entries_edition ON entries(edition_id);
@@ -149,30 +162,142 @@ JOIN entries e ON i.entry_id = e.id
 JOIN entities ent ON i.entity_id = ent.id;
 """
 
+# References reported by name after the load, as (child, parent) -> description
+FOREIGN_KEY_LABELS = {
+    ('entries', 'editions'): 'edition_id',
+    ('alignments', 'entries'): 'entry references',
+    ('identifications', 'entries'): 'entry_id',
+}
+
+# CSV columns per table, in schema order (autoincrement ids are not in the CSVs)
+TABLE_COLUMNS = {
+    'editions': [
+        'id', 'name', 'language', 'type', 'tei_file', 'base_url'
+    ],
+    'entries': [
+        'id', 'edition_id', 'ref', 'segment', 'term', 'term_greek',
+        'term_latin', 'page', 'div_id', 'seg_id', 'url', 'notes'
+    ],
+    'alignments': [
+        'entry_a', 'entry_b', 'alignment_type', 'confidence', 'notes'
+    ],
+    'entities': [
+        'id', 'type', 'modern_name', 'wikidata_id', 'wikipedia_url', 'notes'
+    ],
+    'identifications': [
+        'entry_id', 'entity_id', 'confidence', 'notes'
+    ],
+    'manuscripts': [
+        'id', 'name', 'siglum', 'repository', 'shelfmark',
+        'date_century', 'iiif_manifest', 'digitization_url', 'notes'
+    ],
+    'witnesses': [
+        'entry_id', 'manuscript_id', 'folio', 'line', 'reading',
+        'iiif_canvas', 'iiif_region', 'apparatus_note'
+    ],
+}
+
+# The database is rebuilt from CSV on every run, so trade durability for load speed.
+# The journal stays in memory (not OFF) so a failed batch can still be rolled back.
+# Key columns of the UNIQUE indexes in SCHEMA_INDEXES, for reporting duplicates
+UNIQUE_LINK_KEYS = {
+    'alignments': ('entry_a', 'entry_b'),
+    'identifications': ('entry_id', 'entity_id'),
+    'witnesses': ('entry_id', 'manuscript_id'),
+}
+
+BULK_LOAD_PRAGMAS = """
+PRAGMA journal_mode = MEMORY;
+PRAGMA synchronous = OFF;
+PRAGMA temp_store = MEMORY;
+PRAGMA cache_size = -65536;
+PRAGMA locking_mode = EXCLUSIVE;
+"""
+
+
+def insert_sql(table_name, columns):
+    """Build the INSERT statement for the given columns of a table.
+
+    Empty strings are stored as NULL by SQLite itself (NULLIF), so callers can
+    pass field values through untouched.
+    """
+    placeholders = ', '.join(["NULLIF(?, '')" for _ in columns])
+    column_names = ', '.join(columns)
+    return f'INSERT OR REPLACE INTO {table_name} ({column_names}) VALUES ({placeholders})'
+
 
 def import_csv_to_table(conn, csv_path, table_name, id_column=None):
-    """Import a CSV file into a SQLite table."""
+    """Import a CSV file into a SQLite table, streaming its rows."""
     with open(csv_path, 'r', encoding='utf-8') as f:
-        reader = csv.DictReader(f)
-        rows = list(reader)
+        reader = csv.reader(f)
+        header = next(reader, None) or []
+        # Skip blank lines, as csv.DictReader would
+        rows = filter(None, reader)
+        first = next(rows, None)
+
+        if first is None:
+            print(f'  No data in {csv_path}')
+            return 0
+
+        # Map the CSV header onto the schema's column order once
+        header_index = {name: i for i, name in enumerate(header)}
+        unknown = [name for name in header if name not in TABLE_COLUMNS[table_name]]
+        if unknown:
+            print(f'  Ignoring columns not in {table_name} schema: {", ".join(unknown)}')
+        columns = [col for col in TABLE_COLUMNS[table_name] if col in header_index]
+        indices = [header_index[col] for col in columns]
+
+        sql = insert_sql(table_name, columns)
+        get_values = row_getter(indices)
+        rows = itertools.chain([first], rows)
+
+        # A file whose columns are exactly the schema's, in order (the
+        # export_csv.py layout) binds its full-width rows as they are.
+        if indices == list(range(len(header))):
+            width = len(header)
+            params = (row if len(row) == width else get_values(row) for row in rows)
+        else:
+            params = map(get_values, rows)
+
+        # Rows go from the file into one transaction; `with conn` rolls back
+        # if any fails.
+        try:
+            with conn:
+                return conn.executemany(sql, params).rowcount
+        except sqlite3.Error as e:
+            print(f'  Batch insert failed ({e}); retrying row by row')
 
-    if not rows:
-        print(f'  No data in {csv_path}')
-        return 0
+    with open(csv_path, 'r', encoding='utf-8') as f:
+        reader = csv.reader(f)
+        next(reader, None)
+        return insert_rows_individually(conn, sql, filter(None, reader), get_values)
 
-    # Get column names from CSV
-    columns = list(rows[0].keys())
 
-    # Build INSERT statement
-    placeholders = ', '.join(['?' for _ in columns])
-    column_names = ', '.join(columns)
-    sql = f'INSERT OR REPLACE INTO {table_name} ({column_names}) VALUES ({placeholders})'
+def row_getter(indices):
+    """Return a function picking the insert parameters out of a CSV row.
 
-    # Insert rows
+    Missing trailing fields are padded with empty strings.
+    """
+    width = max(indices, default=-1) + 1
+    # itemgetter returns a bare value, not a tuple, for a single index
+    pick = operator.itemgetter(*indices) if len(indices) > 1 else None
+
+    def get_values(row):
+        if len(row) < width:
+            row = row + [''] * (width - len(row))
+        if pick is None:
+            return tuple(row[i] for i in indices)
+        return pick(row)
+
+    return get_values
+
+
+def insert_rows_individually(conn, sql, rows, get_values):
+    """Slow path: insert rows one at a time, reporting and skipping bad rows."""
     cursor = conn.cursor()
     count = 0
     for row in rows:
-        values = [row.get(col, '') or None for col in columns]
+        values = get_values(row)
         try:
             cursor.execute(sql, values)
             count += 1
@@ -184,12 +309,8 @@ def import_csv_to_table(conn, csv_path, table_name, id_column=None):
     return count
 
 
-def main():
-    # Paths
-    project_dir = Path(__file__).parent.parent
-    data_dir = project_dir / 'data'
-    db_path = data_dir / 'dmm.db'
-
+def create_database(db_path):
+    """Replace db_path with an empty database ready for bulk loading."""
     # Remove existing database
     if db_path.exists():
         db_path.unlink()
@@ -198,7 +319,73 @@ def main():
     # Connect and create schema
     print(f'Creating database: {db_path}')
     conn = sqlite3.connect(db_path)
-    conn.executescript(SCHEMA)
+    conn.executescript(BULK_LOAD_PRAGMAS)
+    conn.executescript(SCHEMA_TABLES)
+    return conn
+
+
+def duplicate_link_rows(conn):
+    """Describe each key pair that occurs more than once in a link table."""
+    lines = []
+    for table_name, (a, b) in UNIQUE_LINK_KEYS.items():
+        cursor = conn.execute(
+            f'SELECT {a}, {b}, COUNT(*) FROM {table_name} '
+            f'GROUP BY {a}, {b} HAVING COUNT(*) > 1 ORDER BY {a}, {b}'
+        )
+        for value_a, value_b, count in cursor:
+            lines.append(f'  {table_name}: ({a}={value_a!r}, {b}={value_b!r}) occurs {count} times')
+    return lines
+
+
+def finish_database(conn, db_path):
+    """Build indexes and views, validate references, print statistics and close."""
+    try:
+        conn.executescript(SCHEMA_INDEXES)
+    except sqlite3.IntegrityError as e:
+        duplicates = duplicate_link_rows(conn)
+        # Do not leave a half-built database in place of the previous one
+        conn.close()
+        db_path.unlink()
+        raise SystemExit(f'Duplicate rows in link tables ({e}):\n' + '\n'.join(duplicates))
+
+    # Validate foreign keys
+    print('\nValidating foreign keys...')
+    conn.execute('PRAGMA foreign_keys = ON')
+
+    # One pass over every declared reference; collect the offending rows per
+    # (child table, parent table) so a row with two bad references counts once.
+    orphans = defaultdict(set)
+    for table_name, rowid, parent, _fkid in conn.execute('PRAGMA foreign_key_check'):
+        orphans[table_name, parent].add(rowid)
+
+    for (table_name, parent), label in FOREIGN_KEY_LABELS.items():
+        count = len(orphans.pop((table_name, parent), ()))
+        if count:
+            print(f'  Warning: {count} {table_name} have invalid {label}')
+        else:
+            print(f'  All {table_name} have valid {label}')
+
+    # References not reported above (e.g. from hand-edited witnesses.csv)
+    for (table_name, parent), rowids in sorted(orphans.items()):
+        print(f'  Warning: {len(rowids)} {table_name} have invalid references to {parent}')
+
+    # Refresh planner statistics now that the tables are populated
+    conn.execute('ANALYZE')
+
+    # Print summary statistics
+    print('\nDatabase statistics:')
+    for table_name in ['editions', 'entries', 'alignments', 'entities', 'identifications', 'manuscripts', 'witnesses']:
+        cursor = conn.execute(f'SELECT COUNT(*) FROM {table_name}')
+        count = cursor.fetchone()[0]
+        print(f'  {table_name}: {count} rows')
+
+    conn.close()
+    print(f'\nDatabase created: {db_path}')
+
+
+def import_data_dir(data_dir, db_path):
+    """Build db_path from the CSV files in data_dir."""
+    conn = create_database(db_path)
 
     # Import tables in dependency order
     tables = [
@@ -220,53 +407,14 @@ def main():
         else:
             print(f'  Skipping {csv_file} (not found)')
 
-    # Validate foreign keys
-    print('\nValidating foreign keys...')
-    conn.execute('PRAGMA foreign_keys = ON')
+    finish_database(conn, db_path)
 
-    # Check for orphaned entries (edition_id not in editions)
-    cursor = conn.execute('''
-        SELECT COUNT(*) FROM entries
-        WHERE edition_id NOT IN (SELECT id FROM editions)
-    ''')
-    orphaned = cursor.fetchone()[0]
-    if orphaned:
-        print(f'  Warning: {orphaned} entries have invalid edition_id')
-    else:
-        print('  All entries have valid edition_id')
-
-    # Check for orphaned alignments
-    cursor = conn.execute('''
-        SELECT COUNT(*) FROM alignments
-        WHERE entry_a NOT IN (SELECT id FROM entries)
-           OR entry_b NOT IN (SELECT id FROM entries)
-    ''')
-    orphaned = cursor.fetchone()[0]
-    if orphaned:
-        print(f'  Warning: {orphaned} alignments have invalid entry references')
-    else:
-        print('  All alignments have valid entry references')
-
-    # Check for orphaned identifications
-    cursor = conn.execute('''
-        SELECT COUNT(*) FROM identifications
-        WHERE entry_id NOT IN (SELECT id FROM entries)
-    ''')
-    orphaned = cursor.fetchone()[0]
-    if orphaned:
-        print(f'  Warning: {orphaned} identifications have invalid entry_id')
-    else:
-        print('  All identifications have valid entry_id')
 
-    # Print summary statistics
-    print('\nDatabase statistics:')
-    for table_name in ['editions', 'entries', 'alignments', 'entities', 'identifications', 'manuscripts', 'witnesses']:
-        cursor = conn.execute(f'SELECT COUNT(*) FROM {table_name}')
-        count = cursor.fetchone()[0]
-        print(f'  {table_name}: {count} rows')
-
-    conn.close()
-    print(f'\nDatabase created: {db_path}')
+def main():
+    # Paths
+    project_dir = Path(__file__).parent.parent
+    data_dir = project_dir / 'data'
+    import_data_dir(data_dir, data_dir / 'dmm.db')
 
 
 if __name__ == '__main__':
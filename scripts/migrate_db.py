@@ -15,11 +15,14 @@ Usage:
 """
 
 import csv
+import functools
 import html
+import itertools
 import os
 import re
 import xml.etree.ElementTree as ET
 from pathlib import Path
+from typing import NamedTuple
 
 # Edition prefix mappings from XML attributes to edition IDs
 EDITION_PREFIXES = {
@@ -44,69 +47,124 @@ SUPPLEMENTARY_PREFIXES = {
     'lsj': 'lsj',         # lsj_id, lsj_bk, lsj_grk, lsj_eng, lsj_spec
 }
 
+# (edition_id, ref attribute, spec attribute) for each edition prefix
+SPEC_KEYS = [
+    (edition_id, f'{prefix}_id', f'{prefix}_spec')
+    for prefix, edition_id in EDITION_PREFIXES.items()
+]
+
+# Attribute names read for each edition's entry, spelled out once:
+# (edition_id, id, name, grk, pag, tt, url, Latin term or None).
+# Only Sprengel carries a Latin term (sp_lat).
+ENTRY_KEYS = [
+    (edition_id, f'{prefix}_id', f'{prefix}_name', f'{prefix}_grk',
+     f'{prefix}_pag', f'{prefix}_tt', f'{prefix}_url',
+     'sp_lat' if prefix == 'sp' else None)
+    for prefix, edition_id in EDITION_PREFIXES.items()
+]
+
+HTML_TAG_RE = re.compile(r'<[^>]+>')
+
+# Botanical names, found in one scan: genus + species like "Iris germanica",
+# "Meum athamanticum" (sometimes with an author abbreviation), or as a fallback
+# a bare genus or family name. A genus match never covers the start of a
+# species match, so the species hits are exactly what a species-only scan finds.
+BOTANICAL_NAME_RE = re.compile(
+    r'(?P<species>[A-Z][a-z]+\s+[a-z]+(?:\s+[A-Z][a-z]*\.?)?)'
+    r'|\b(?P<genus>[A-Z][a-z]+(?:aceae|ales)?)\b'
+)
+
 
 def clean_html(text):
     """Strip HTML tags and decode entities from text."""
     if not text:
         return ''
-    # Decode HTML entities
-    text = html.unescape(text)
-    # Remove HTML tags
-    text = re.sub(r'<[^>]+>', '', text)
-    # Clean up whitespace
-    text = ' '.join(text.split())
-    return text.strip()
-
-
+    # Most attribute values are plain text: only pay for unescaping and tag
+    # stripping when there is something to strip. Unescape first, since
+    # entities like &lt; can produce tags.
+    if '&' in text:
+        text = html.unescape(text)
+    if '<' in text:
+        text = HTML_TAG_RE.sub('', text)
+    # Clean up whitespace. In printable text the only whitespace is plain
+    # spaces, so unless some are doubled a strip does the same as split/join.
+    if '  ' not in text and text.isprintable():
+        return text.strip()
+    return ' '.join(text.split())
+
+
+@functools.lru_cache(maxsize=None)
 def extract_species_name(spec_text):
-    """Extract botanical species names from specification text."""
+    """Extract botanical species names from specification text.
+
+    Cached, since the same identification text recurs across many items;
+    returns a tuple so the shared result cannot be mutated by callers.
+    """
     if not spec_text:
-        return []
+        return ()
 
     # Clean HTML
     text = clean_html(spec_text)
 
-    # Look for patterns like "Iris germanica", "Meum athamanticum", etc.
-    # Typically genus + species, sometimes with author
-    species_pattern = r'([A-Z][a-z]+\s+[a-z]+(?:\s+[A-Z][a-z]*\.?)?)'
-    matches = re.findall(species_pattern, text)
+    # Prefer genus + species names; fall back to any capitalized
+    # botanical-looking (genus or family) names only if there are none.
+    species = []
+    genera = []
+    for m in BOTANICAL_NAME_RE.finditer(text):
+        if m.group('species') is not None:
+            species.append(m.group('species'))
+        elif not species:
+            genera.append(m.group('genus'))
 
-    # Also look for just genus names or family names
-    if not matches:
-        # Try to find any capitalized botanical-looking names
-        genus_pattern = r'\b([A-Z][a-z]+(?:aceae|ales)?)\b'
-        matches = re.findall(genus_pattern, text)
-
-    return list(set(matches))
+    return tuple(set(species or genera))
 
 
 def parse_xml(xml_path):
     """Parse the XML database and extract all items."""
-    tree = ET.parse(xml_path)
-    root = tree.getroot()
-
+    # Items are flat <item .../> children of <items>; stream them rather than
+    # building the whole tree, clearing each one once its attributes are copied.
     items = []
-    for item in root.findall('item'):
-        items.append(dict(item.attrib))
+    for _, elem in ET.iterparse(xml_path):
+        if elem.tag == 'item':
+            items.append(dict(elem.attrib))
+            elem.clear()
 
     return items
 
 
+class Entry(NamedTuple):
+    """One row of entries.csv, in column order."""
+    id: str
+    edition_id: str
+    ref: str
+    segment: str
+    term: str
+    term_greek: str
+    term_latin: str
+    page: str
+    div_id: str
+    seg_id: str
+    url: str
+    notes: str
+
+
 def extract_entries(items):
-    """Extract entries for each edition from items."""
+    """
+    Extract entries for each edition from items.
+
+    Returns (entries, item_ids): Entry rows plus, in parallel, the id of the
+    XML item each entry came from (used to build alignments).
+    """
     entries = []
+    item_ids = []
 
     for item in items:
-        book = item.get('book', '')
         item_id = item.get('id', '')
-        nerid = item.get('nerid', '')
-        tuid = item.get('tuid', '')
-        notes = item.get('notes', '')
 
         # Process each edition prefix
-        for prefix, edition_id in EDITION_PREFIXES.items():
+        for (edition_id, ref_key, name_key, grk_key, pag_key, tt_key, url_key,
+             latin_key) in ENTRY_KEYS:
             # Get the reference ID (chapter.section)
-            ref_key = f'{prefix}_id'
             ref = item.get(ref_key, '')
 
             if not ref:
@@ -115,111 +173,86 @@ def extract_entries(items):
             # Build entry ID
             entry_id = f'{edition_id}:{ref}'
 
-            # Get term/name
-            name_key = f'{prefix}_name'
-            term = item.get(name_key, '')
-            term = clean_html(term)
-
-            # Get Greek form if available
-            grk_key = f'{prefix}_grk'
+            # Term/name, Greek form, page number, div ID for TEI linking, URL
+            term = clean_html(item.get(name_key, ''))
             term_greek = item.get(grk_key, '')
-
-            # Get page number
-            pag_key = f'{prefix}_pag'
             page = item.get(pag_key, '')
-
-            # Get div ID for TEI linking
-            tt_key = f'{prefix}_tt'
             div_id = item.get(tt_key, '')
-
-            # Get URL if available
-            url_key = f'{prefix}_url'
             url = item.get(url_key, '')
 
-            entry = {
-                'id': entry_id,
-                'edition_id': edition_id,
-                'ref': ref,
-                'segment': '',  # No segments in current data
-                'term': term,
-                'term_greek': term_greek,
-                'term_latin': '',  # Could extract from sp_lat
-                'page': page,
-                'div_id': div_id,
-                'seg_id': '',
-                'url': url,
-                'notes': '',
-                '_item_id': item_id,  # Internal tracking
-                '_nerid': nerid,
-                '_tuid': tuid,
-            }
-
             # Special handling for Sprengel Latin term
-            if prefix == 'sp':
-                entry['term_latin'] = item.get('sp_lat', '')
-
-            entries.append(entry)
-
-    return entries
-
-
-def extract_alignments(items, entries):
+            term_latin = item.get(latin_key, '') if latin_key else ''
+
+            entries.append(Entry(
+                id=entry_id,
+                edition_id=edition_id,
+                ref=ref,
+                segment='',  # No segments in current data
+                term=term,
+                term_greek=term_greek,
+                term_latin=term_latin,
+                page=page,
+                div_id=div_id,
+                seg_id='',
+                url=url,
+                notes='',
+            ))
+            item_ids.append(item_id)
+
+    return entries, item_ids
+
+
+def extract_alignments(entries, item_ids):
     """Create alignments between entries that share the same XML item."""
     alignments = []
 
     # Group entries by their source item_id
     entries_by_item = {}
-    for entry in entries:
-        item_id = entry.get('_item_id', '')
+    for entry, item_id in zip(entries, item_ids):
         if item_id not in entries_by_item:
             entries_by_item[item_id] = []
         entries_by_item[item_id].append(entry)
 
-    # Create pairwise alignments within each item group
-    seen_pairs = set()
-    for item_id, item_entries in entries_by_item.items():
-        # Sort entries by edition for consistent ordering
-        item_entries.sort(key=lambda e: e['edition_id'])
-
-        # Create alignments between all pairs
-        for i, entry_a in enumerate(item_entries):
-            for entry_b in item_entries[i+1:]:
-                pair = tuple(sorted([entry_a['id'], entry_b['id']]))
-                if pair not in seen_pairs:
-                    seen_pairs.add(pair)
-                    alignments.append({
-                        'entry_a': entry_a['id'],
-                        'entry_b': entry_b['id'],
-                        'alignment_type': 'equivalent',
-                        'confidence': 'certain',
-                        'notes': '',
-                    })
+    # Create pairwise alignments within each item group. Entry ids start with
+    # their edition id and no edition id is a prefix of another, so sorting a
+    # group by edition also orders each pair by id: (a, b) is already the
+    # canonical key. The same pair can recur in another item (entry ids repeat
+    # across items); dict.fromkeys keeps the first occurrence.
+    pairs = dict.fromkeys(
+        (entry_a.id, entry_b.id)
+        for item_entries in entries_by_item.values()
+        for entry_a, entry_b in itertools.combinations(
+            sorted(item_entries, key=lambda e: e.edition_id), 2
+        )
+    )
+
+    for entry_a, entry_b in pairs:
+        # entry_a, entry_b, alignment_type, confidence, notes
+        alignments.append((entry_a, entry_b, 'equivalent', 'certain', ''))
 
     return alignments
 
 
 def extract_identifications(items, entries):
     """Extract botanical identifications from _spec fields."""
-    identifications = []
-    entities = {}  # entity_name -> entity_data
+    identifications = {}  # (entry_id, entity_id) -> identification
+    entities = {}  # entity_id -> modern_name
 
     # Build a lookup of entries by edition + ref
     entry_lookup = {}
     for entry in entries:
-        key = (entry['edition_id'], entry['ref'])
-        entry_lookup[key] = entry['id']
+        key = (entry.edition_id, entry.ref)
+        entry_lookup[key] = entry.id
 
     for item in items:
         # Check each edition's _spec field
-        for prefix, edition_id in EDITION_PREFIXES.items():
-            spec_key = f'{prefix}_spec'
+        for edition_id, ref_key, spec_key in SPEC_KEYS:
             spec_text = item.get(spec_key, '')
 
             if not spec_text:
                 continue
 
             # Get the entry ID for this edition's entry
-            ref_key = f'{prefix}_id'
             ref = item.get(ref_key, '')
             if not ref:
                 continue
@@ -232,43 +265,57 @@ def extract_identifications(items, entries):
             species_names = extract_species_name(spec_text)
 
             for species_name in species_names:
-                # Create or update entity
+                # First spelling seen for an entity id names it
                 entity_id = species_name.lower().replace(' ', '_').replace('.', '')
-                if entity_id not in entities:
-                    entities[entity_id] = {
-                        'id': entity_id,
-                        'type': 'plant',  # Default, could be refined
-                        'modern_name': species_name,
-                        'wikidata_id': '',
-                        'wikipedia_url': '',
-                        'notes': '',
-                    }
-
-                # Create identification
-                identifications.append({
-                    'entry_id': entry_id,
-                    'entity_id': entity_id,
-                    'confidence': 'certain',  # From published edition
-                    'notes': f'Extracted from {edition_id}',
-                })
-
-    # Remove duplicate identifications
-    seen = set()
-    unique_identifications = []
-    for ident in identifications:
-        key = (ident['entry_id'], ident['entity_id'])
-        if key not in seen:
-            seen.add(key)
-            unique_identifications.append(ident)
-
-    return unique_identifications, list(entities.values())
+                entities.setdefault(entity_id, species_name)
+
+                # Create identification (first attribution of a pair wins)
+                key = (entry_id, entity_id)
+                if key not in identifications:
+                    # entry_id, entity_id, confidence (from published edition), notes
+                    identifications[key] = (
+                        entry_id, entity_id, 'certain', f'Extracted from {edition_id}'
+                    )
+
+    # id, type (default, could be refined), modern_name,
+    # wikidata_id, wikipedia_url, notes
+    entity_rows = [
+        (entity_id, 'plant', name, '', '', '') for entity_id, name in entities.items()
+    ]
+
+    return list(identifications.values()), entity_rows
+
+
+# Placeholder rows for the manuscript tables (see create_empty_templates)
+MANUSCRIPTS_TEMPLATE = [(
+    'vindob_gr_1',                          # id
+    'Codex Vindobonensis med. gr. 1',       # name
+    'V',                                    # siglum
+    'Österreichische Nationalbibliothek',   # repository
+    'Cod. med. gr. 1',                      # shelfmark
+    '6',                                    # date_century
+    '',                                     # iiif_manifest
+    '',                                     # digitization_url
+    'Vienna Dioscorides',                   # notes
+)]
+
+WITNESSES_TEMPLATE = [(
+    'wellmann:1.1',     # entry_id
+    'vindob_gr_1',      # manuscript_id
+    '',                 # folio
+    '',                 # line
+    '',                 # reading
+    '',                 # iiif_canvas
+    '',                 # iiif_region
+    '',                 # apparatus_note
+)]
 
 
 def write_csv(filepath, data, fieldnames):
-    """Write data to CSV file."""
+    """Write rows (sequences in fieldnames order) to CSV file."""
     with open(filepath, 'w', newline='', encoding='utf-8') as f:
-        writer = csv.DictWriter(f, fieldnames=fieldnames, extrasaction='ignore')
-        writer.writeheader()
+        writer = csv.writer(f)
+        writer.writerow(fieldnames)
         writer.writerows(data)
     print(f'Wrote {len(data)} rows to {filepath}')
 
@@ -281,43 +328,18 @@ def create_empty_templates(data_dir):
         'id', 'name', 'siglum', 'repository', 'shelfmark',
         'date_century', 'iiif_manifest', 'digitization_url', 'notes'
     ]
-    manuscripts_example = [{
-        'id': 'vindob_gr_1',
-        'name': 'Codex Vindobonensis med. gr. 1',
-        'siglum': 'V',
-        'repository': 'Österreichische Nationalbibliothek',
-        'shelfmark': 'Cod. med. gr. 1',
-        'date_century': '6',
-        'iiif_manifest': '',
-        'digitization_url': '',
-        'notes': 'Vienna Dioscorides',
-    }]
-    write_csv(data_dir / 'manuscripts.csv', manuscripts_example, manuscripts_fields)
+    write_csv(data_dir / 'manuscripts.csv', MANUSCRIPTS_TEMPLATE, manuscripts_fields)
 
     # witnesses.csv template
     witnesses_fields = [
         'entry_id', 'manuscript_id', 'folio', 'line', 'reading',
         'iiif_canvas', 'iiif_region', 'apparatus_note'
     ]
-    witnesses_example = [{
-        'entry_id': 'wellmann:1.1',
-        'manuscript_id': 'vindob_gr_1',
-        'folio': '',
-        'line': '',
-        'reading': '',
-        'iiif_canvas': '',
-        'iiif_region': '',
-        'apparatus_note': '',
-    }]
-    write_csv(data_dir / 'witnesses.csv', witnesses_example, witnesses_fields)
+    write_csv(data_dir / 'witnesses.csv', WITNESSES_TEMPLATE, witnesses_fields)
 
 
-def main():
-    # Paths
-    project_dir = Path(__file__).parent.parent
-    xml_path = project_dir / 'dioscmatmad_db.xml'
-    data_dir = project_dir / 'data'
-
+def migrate(xml_path, data_dir):
+    """Write the migrated CSVs for xml_path into data_dir."""
     # Ensure data directory exists
     data_dir.mkdir(exist_ok=True)
 
@@ -327,12 +349,12 @@ def main():
 
     # Extract entries
     print('Extracting entries...')
-    entries = extract_entries(items)
+    entries, item_ids = extract_entries(items)
     print(f'Extracted {len(entries)} entries')
 
     # Extract alignments
     print('Creating alignments...')
-    alignments = extract_alignments(items, entries)
+    alignments = extract_alignments(entries, item_ids)
     print(f'Created {len(alignments)} alignments')
 
     # Extract identifications and entities
@@ -342,10 +364,7 @@ def main():
     print(f'Found {len(entities)} unique entities')
 
     # Write CSVs
-    entry_fields = [
-        'id', 'edition_id', 'ref', 'segment', 'term', 'term_greek',
-        'term_latin', 'page', 'div_id', 'seg_id', 'url', 'notes'
-    ]
+    entry_fields = list(Entry._fields)
     write_csv(data_dir / 'entries.csv', entries, entry_fields)
 
     alignment_fields = ['entry_a', 'entry_b', 'alignment_type', 'confidence', 'notes']
@@ -365,5 +384,11 @@ def main():
     print(f'Output files written to {data_dir}/')
 
 
+def main():
+    # Paths
+    project_dir = Path(__file__).parent.parent
+    migrate(project_dir / 'dioscmatmad_db.xml', project_dir / 'data')
+
+
 if __name__ == '__main__':
     main()
@@ -10,9 +10,11 @@ import argparse
 import csv
 import json
 from dataclasses import dataclass
+from operator import itemgetter
 import re
+import string
 from pathlib import Path
-from typing import Dict, List, Optional, Tuple
+from typing import Callable, Dict, Iterator, List, Optional, Set, Tuple
 
 
 CITATION_IIIF_HEADER = [
@@ -59,10 +61,27 @@ BAD_ROWS_HEADER = [
     "source_row",
 ]
 
-NON_TEI_IN_SCOPE = ["barbaro", "desmoulins", "lusitanus", "ruellius", "wechel"]
+# A citation_iiif_map.csv row, in CITATION_IIIF_HEADER order: edition_id,
+# citation_ref, manifest_url, canvas_id, canvas_label, canvas_index,
+# target_url, status, notes
+MapRow = Tuple[str, str, str, str, str, str, str, str, str]
 
+# Sort keys for the output rows, which always carry these columns
+EDITION_KEY = itemgetter("edition_id")
+EDITION_CITATION_KEY = itemgetter("edition_id", "citation_ref")
+MAP_ROW_KEY = itemgetter(0, 1)
 
-@dataclass
+# Cache-miss marker where None is a cached value
+MISSING = object()
+
+# Files are read and written through 1 MiB buffers, for fewer syscalls
+READ_BUFFER_SIZE = 1 << 20
+WRITE_BUFFER_SIZE = 1 << 20
+
+NON_TEI_IN_SCOPE = frozenset(["barbaro", "desmoulins", "lusitanus", "ruellius", "wechel"])
+
+
+@dataclass(frozen=True)
 class ManifestInfo:
     edition_id: str
     manifest_url: str
@@ -70,7 +89,7 @@ class ManifestInfo:
     why_provisional: str
 
 
-@dataclass
+@dataclass(frozen=True)
 class IiifRule:
     edition_id: str
     iiif_kind: str
@@ -81,63 +100,98 @@ class IiifRule:
     target_template: str
     canvas_index_base: Optional[int]
     notes: str
+    compiled_template: Optional[CompiledTemplate] = None
+    uses_extra_json: bool = True
 
 
 def read_csv(path: Path) -> List[Dict[str, str]]:
-    with path.open("r", encoding="utf-8", newline="") as f:
+    with path.open("r", encoding="utf-8", newline="", buffering=READ_BUFFER_SIZE) as f:
         reader = csv.DictReader(f)
         return [row for row in reader]
 
 
+def iter_csv_rows(path: Path) -> Iterator[List[str]]:
+    """Stream a CSV's rows (header first) as plain lists, skipping blank lines."""
+    with path.open("r", encoding="utf-8", newline="", buffering=READ_BUFFER_SIZE) as f:
+        for row in csv.reader(f):
+            if row:
+                yield row
+
+
+def cell(row: List[str], index: Optional[int]) -> str:
+    if index is None or index >= len(row):
+        return ""
+    return row[index]
+
+
+def row_to_dict(header: List[str], row: List[str]) -> Dict[str, str]:
+    if len(row) < len(header):
+        row = row + [""] * (len(header) - len(row))
+    return dict(zip(header, row))
+
+
 def write_csv(path: Path, header: List[str], rows: List[Dict[str, str]]) -> None:
     path.parent.mkdir(parents=True, exist_ok=True)
-    with path.open("w", encoding="utf-8", newline="") as f:
+    with path.open("w", encoding="utf-8", newline="", buffering=WRITE_BUFFER_SIZE) as f:
+        writer = csv.DictWriter(
+            f, fieldnames=header, lineterminator="\n", restval="", extrasaction="ignore"
+        )
+        writer.writeheader()
+        writer.writerows(rows)
+
+
+def write_csv_rows(path: Path, header: List[str], rows: List[Tuple[str, ...]]) -> None:
+    """Write rows that are already sequences in header order."""
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with path.open("w", encoding="utf-8", newline="", buffering=WRITE_BUFFER_SIZE) as f:
         writer = csv.writer(f, lineterminator="\n")
         writer.writerow(header)
-        for row in rows:
-            writer.writerow([row.get(h, "") for h in header])
+        writer.writerows(rows)
 
 
 def load_manifest(path: Path) -> Optional[Dict]:
-    if not path.exists():
+    # One read into bytes; json.loads decodes UTF-8 in C, skipping the text
+    # layer's chunked decoding of large manifests.
+    try:
+        data = path.read_bytes()
+    except FileNotFoundError:
         return None
-    with path.open("r", encoding="utf-8") as f:
-        return json.load(f)
+    return json.loads(data)
 
 
-def extract_canvas_ids(manifest: Dict) -> List[str]:
+def extract_canvas_ids(manifest: Dict) -> Tuple[str, ...]:
+    # A tuple, since the ids are cached and shared per edition
     if not manifest:
-        return []
-    if "items" in manifest and isinstance(manifest["items"], list):
-        canvases = manifest["items"]
-        ids = []
-        for c in canvases:
-            if isinstance(c, dict) and "id" in c:
-                ids.append(c["id"])
-        return ids
-    if "sequences" in manifest:
-        sequences = manifest.get("sequences") or []
-        if sequences:
-            canvases = sequences[0].get("canvases") or []
-            ids = []
-            for c in canvases:
-                if isinstance(c, dict):
-                    cid = c.get("@id") or c.get("id")
-                    if cid:
-                        ids.append(cid)
-            return ids
-    return []
-
-
-def parse_int(value: Optional[str]) -> Optional[int]:
-    if value is None:
-        return None
-    v = value.strip()
-    if not v:
-        return None
-    if v.isdigit():
-        return int(v)
-    return None
+        return ()
+    items = manifest.get("items")
+    if isinstance(items, list):
+        return tuple(c["id"] for c in items if isinstance(c, dict) and "id" in c)
+    sequences = manifest.get("sequences")
+    if sequences:
+        canvases = sequences[0].get("canvases") or ()
+        ids = (c.get("@id") or c.get("id") for c in canvases if isinstance(c, dict))
+        return tuple(cid for cid in ids if cid)
+    return ()
+
+
+def resolve_canvas_index(
+    value: str, base: int, canvases: Optional[Tuple[str, ...]]
+) -> Tuple[int, str, Optional[str]]:
+    """Turn a page number counted from base into (canvas_index, canvas_id, error)."""
+    # Plain digits are the common case; only strip when that check fails.
+    # isdigit() rather than try/int(), which would also take signs and "_".
+    if not value.isdigit():
+        value = value.strip()
+        if not value.isdigit():
+            return -1, "", "missing_or_non_numeric_index"
+    canvas_index = int(value) - base
+    if canvas_index < 0:
+        return canvas_index, "", "negative_canvas_index"
+    if canvases is None:
+        return canvas_index, "", None
+    if canvas_index >= len(canvases):
+        return canvas_index, "", "canvas_index_out_of_range"
+    return canvas_index, canvases[canvas_index], None
 
 
 def load_manifests(manifest_csv: Path) -> Dict[str, ManifestInfo]:
@@ -171,6 +225,10 @@ def load_rules(rules_csv: Path) -> Dict[str, IiifRule]:
             target_template=row.get("target_template", ""),
             canvas_index_base=base_int,
             notes=row.get("notes", ""),
+            compiled_template=compile_template(row.get("target_template", "")),
+            uses_extra_json=rule_uses_extra_json(
+                row.get("citation_key_field", ""), row.get("target_template", "")
+            ),
         )
     return out
 
@@ -188,6 +246,16 @@ def parse_extra_json(citation: Dict[str, str]) -> Dict[str, str]:
     return {}
 
 
+def rule_uses_extra_json(citation_key_field: str, template: str) -> bool:
+    # extra_json.* values are only read through the citation key field and
+    # TEITOK tokens; {extra_json} format fields use the raw column.
+    if citation_key_field.startswith("extra_json."):
+        return True
+    return any(
+        match.group(3).startswith("extra_json.") for match in TEITOK_PATTERN.finditer(template)
+    )
+
+
 def get_citation_value(citation: Dict[str, str], field: str, extra: Dict[str, str]) -> str:
     if field.startswith("extra_json."):
         key = field.split(".", 1)[1]
@@ -198,103 +266,272 @@ def get_citation_value(citation: Dict[str, str], field: str, extra: Dict[str, st
 TEITOK_PATTERN = re.compile(r"\{\{(\d+)%(-?\d+)%([A-Za-z0-9_.]+)\}\}")
 
 
+def render_teitok_number(
+    citation: Dict[str, str], field: str, width: int, offset: int, extra: Dict[str, str]
+) -> str:
+    value = get_citation_value(citation, field, extra)
+    if not value:
+        raise ValueError(f"missing_field:{field}")
+    if not value.isdigit():
+        raise ValueError(f"non_numeric_field:{field}")
+    num = int(value) + offset
+    if width <= 0:
+        return str(num)
+    return str(num).zfill(width)
+
+
 def render_template(template: str, citation: Dict[str, str], extra: Dict[str, str], context: Dict[str, str]) -> str:
-    def replace(match: re.Match) -> str:
-        width = int(match.group(1))
-        offset = int(match.group(2))
-        field = match.group(3)
-        value = get_citation_value(citation, field, extra)
-        if value is None or value == "":
-            raise ValueError(f"missing_field:{field}")
-        if not str(value).isdigit():
-            raise ValueError(f"non_numeric_field:{field}")
-        num = int(value) + offset
-        if width <= 0:
-            return str(num)
-        return str(num).zfill(width)
-
-    rendered = TEITOK_PATTERN.sub(replace, template)
-    return rendered.format(**context)
-
-
-def build_target(
-    citation: Dict[str, str],
-    rule: IiifRule,
-    manifest_info: ManifestInfo,
-    manifest: Optional[Dict],
-) -> Tuple[Optional[Dict[str, str]], Optional[str]]:
-    status = manifest_info.status or "provisional"
-    manifest_url = manifest_info.manifest_url or rule.manifest_url
+    # Splice the TEITOK numbers between slices of the template, then format
+    parts = []
+    pos = 0
+    for match in TEITOK_PATTERN.finditer(template):
+        parts.append(template[pos:match.start()])
+        parts.append(render_teitok_number(
+            citation, match.group(3), int(match.group(1)), int(match.group(2)), extra
+        ))
+        pos = match.end()
+    parts.append(template[pos:])
+    return "".join(parts).format(**context)
+
+
+# CompiledTemplate part kinds
+LITERAL = 0
+TEITOK = 1
+FIELD = 2
+
+
+@dataclass(frozen=True)
+class CompiledTemplate:
+    # (kind, text, width, offset): literal text, a TEITOK number (text is the
+    # citation field, zero-padded to width after adding offset) or a
+    # {field} looked up in the citation.
+    parts: Tuple[Tuple[int, str, int, int], ...]
+
+    def render(self, citation: Dict[str, str], extra: Dict[str, str], overrides: Dict[str, str]) -> str:
+        """Same result as render_template on the same inputs; errors are KeyError or ValueError like it."""
+        out = []
+        for kind, text, width, offset in self.parts:
+            if kind == LITERAL:
+                out.append(text)
+            elif kind == TEITOK:
+                out.append(render_teitok_number(citation, text, width, offset, extra))
+            else:
+                out.append(overrides[text] if text in overrides else citation[text])
+        return "".join(out)
+
+
+def compile_template(template: str) -> Optional[CompiledTemplate]:
+    """Pre-parse a target template, or return None when it needs the general path.
+
+    TEITOK tokens are swapped for NUL-delimited markers before the str.format
+    parse, so the literal/field structure is the one render_template sees.
+    Only bare {name} fields are compiled; conversions, format specs, attribute
+    or index access, positional fields and malformed braces are left to
+    render_template.
+    """
+    if not template or "\0" in template:
+        return None
+    tokens: List[Tuple[int, int, str]] = []
+
+    def mark(match: re.Match) -> str:
+        tokens.append((int(match.group(1)), int(match.group(2)), match.group(3)))
+        return f"\0{len(tokens) - 1}\0"
+
+    skeleton = TEITOK_PATTERN.sub(mark, template)
+    try:
+        parsed = list(string.Formatter().parse(skeleton))
+    except ValueError:
+        return None
+
+    parts: List[Tuple[int, str, int, int]] = []
+    for literal, field_name, format_spec, conversion in parsed:
+        # Markers split the literal into text (even) and token indexes (odd)
+        for i, piece in enumerate(literal.split("\0")):
+            if i % 2:
+                width, offset, field = tokens[int(piece)]
+                parts.append((TEITOK, field, width, offset))
+            elif piece:
+                parts.append((LITERAL, piece, 0, 0))
+        if field_name is None:
+            continue
+        if format_spec or conversion or not field_name.isidentifier():
+            return None
+        parts.append((FIELD, field_name, 0, 0))
+    return CompiledTemplate(tuple(parts))
+
+
+def map_row(
+    edition_id: str,
+    citation_ref: str,
+    manifest_url: str,
+    canvas_id: str = "",
+    canvas_label: str = "",
+    canvas_index: str = "",
+    target_url: str = "",
+    status: str = "",
+    notes: str = "",
+) -> MapRow:
+    return (
+        edition_id,
+        citation_ref,
+        manifest_url,
+        canvas_id,
+        canvas_label,
+        canvas_index,
+        target_url,
+        status,
+        notes,
+    )
 
+
+def read_citation_key(
+    citation: Dict[str, str], rule: IiifRule
+) -> Tuple[Dict[str, str], str, Optional[str]]:
+    """Return (extra_json fields, citation key value, error) for a citation."""
     citation_key_field = rule.citation_key_field
-    extra = parse_extra_json(citation)
+    # Only rules that read extra_json.* fields pay for decoding it
+    extra = parse_extra_json(citation) if rule.uses_extra_json else {}
     citation_key_value = get_citation_value(citation, citation_key_field, extra) if citation_key_field else ""
     if citation_key_field and not citation_key_value:
-        return None, "missing_citation_key_field"
-
-    if rule.target_rule == "canvas_index":
-        idx_value = parse_int(citation_key_value)
-        if idx_value is None:
-            return None, "missing_or_non_numeric_index"
-        base = rule.canvas_index_base if rule.canvas_index_base is not None else 0
-        canvas_index = idx_value - base
-        if canvas_index < 0:
-            return None, "negative_canvas_index"
-        canvas_id = ""
-        if manifest:
-            canvases = extract_canvas_ids(manifest)
-            if canvas_index >= len(canvases):
-                return None, "canvas_index_out_of_range"
-            canvas_id = canvases[canvas_index]
-        return {
-            "edition_id": citation["edition_id"],
-            "citation_ref": citation["citation_ref"],
-            "manifest_url": manifest_url,
-            "canvas_id": canvas_id,
-            "canvas_label": citation.get("page_label", ""),
-            "canvas_index": str(canvas_index),
-            "target_url": "",
-            "status": status,
-            "notes": "",
-        }, None
-
-    if rule.target_rule in ("canvas_id_template", "image_api_template", "target_url_template"):
-        template = rule.target_template
-        if not template:
-            return None, "missing_target_template"
+        return extra, citation_key_value, "missing_citation_key_field"
+    return extra, citation_key_value, None
+
+
+def render_rule_template(
+    citation: Dict[str, str], rule: IiifRule, extra: Dict[str, str], citation_key_value: str
+) -> Tuple[str, Optional[str]]:
+    """Return (rendered target template, error) for a citation."""
+    template = rule.target_template
+    if not template:
+        return "", "missing_target_template"
+    overrides = {
+        "citation_key_value": citation_key_value,
+        "citation_key_field": rule.citation_key_field,
+    }
+    try:
+        if rule.compiled_template is not None:
+            return rule.compiled_template.render(citation, extra, overrides), None
         context = dict(citation)
-        context["citation_key_value"] = citation_key_value
-        context["citation_key_field"] = citation_key_field
-        try:
-            rendered = render_template(template, citation, extra, context)
-        except (KeyError, ValueError):
-            return None, "template_missing_fields"
-        if rule.target_rule == "canvas_id_template":
-            return {
-                "edition_id": citation["edition_id"],
-                "citation_ref": citation["citation_ref"],
-                "manifest_url": manifest_url,
-                "canvas_id": rendered,
-                "canvas_label": citation.get("page_label", ""),
-                "canvas_index": "",
-                "target_url": "",
-                "status": status,
-                "notes": "",
-            }, None
-        # image_api_template or target_url_template
-        return {
-            "edition_id": citation["edition_id"],
-            "citation_ref": citation["citation_ref"],
-            "manifest_url": manifest_url,
-            "canvas_id": "",
-            "canvas_label": "",
-            "canvas_index": "",
-            "target_url": rendered,
-            "status": status,
-            "notes": "",
-        }, None
-
-    return None, "unsupported_target_rule"
+        context.update(overrides)
+        return render_template(template, citation, extra, context), None
+    except (KeyError, ValueError):
+        return "", "template_missing_fields"
+
+
+def build_canvas_index_target(
+    citation: Dict[str, str],
+    rule: IiifRule,
+    manifest_info: ManifestInfo,
+    canvases: Optional[Tuple[str, ...]],
+) -> Tuple[Optional[MapRow], Optional[str]]:
+    _, citation_key_value, err = read_citation_key(citation, rule)
+    if err:
+        return None, err
+    canvas_index, canvas_id, err = resolve_canvas_index(
+        citation_key_value, rule.canvas_index_base or 0, canvases
+    )
+    if err:
+        return None, err
+    return map_row(
+        citation["edition_id"],
+        citation["citation_ref"],
+        manifest_info.manifest_url or rule.manifest_url,
+        canvas_id=canvas_id,
+        canvas_label=citation.get("page_label", ""),
+        canvas_index=str(canvas_index),
+        status=manifest_info.status or "provisional",
+    ), None
+
+
+def build_canvas_id_template_target(
+    citation: Dict[str, str],
+    rule: IiifRule,
+    manifest_info: ManifestInfo,
+    canvases: Optional[Tuple[str, ...]],
+) -> Tuple[Optional[MapRow], Optional[str]]:
+    extra, citation_key_value, err = read_citation_key(citation, rule)
+    if err:
+        return None, err
+    rendered, err = render_rule_template(citation, rule, extra, citation_key_value)
+    if err:
+        return None, err
+    return map_row(
+        citation["edition_id"],
+        citation["citation_ref"],
+        manifest_info.manifest_url or rule.manifest_url,
+        canvas_id=rendered,
+        canvas_label=citation.get("page_label", ""),
+        status=manifest_info.status or "provisional",
+    ), None
+
+
+def build_url_template_target(
+    citation: Dict[str, str],
+    rule: IiifRule,
+    manifest_info: ManifestInfo,
+    canvases: Optional[Tuple[str, ...]],
+) -> Tuple[Optional[MapRow], Optional[str]]:
+    # image_api_template or target_url_template
+    extra, citation_key_value, err = read_citation_key(citation, rule)
+    if err:
+        return None, err
+    rendered, err = render_rule_template(citation, rule, extra, citation_key_value)
+    if err:
+        return None, err
+    return map_row(
+        citation["edition_id"],
+        citation["citation_ref"],
+        manifest_info.manifest_url or rule.manifest_url,
+        target_url=rendered,
+        status=manifest_info.status or "provisional",
+    ), None
+
+
+def build_unsupported_target(
+    citation: Dict[str, str],
+    rule: IiifRule,
+    manifest_info: ManifestInfo,
+    canvases: Optional[Tuple[str, ...]],
+) -> Tuple[Optional[MapRow], Optional[str]]:
+    _, _, err = read_citation_key(citation, rule)
+    return None, err or "unsupported_target_rule"
+
+
+TargetBuilder = Callable[
+    [Dict[str, str], IiifRule, ManifestInfo, Optional[Tuple[str, ...]]],
+    Tuple[Optional[MapRow], Optional[str]],
+]
+
+# target_rule -> builder; anything else is unsupported
+TARGET_BUILDERS: Dict[str, TargetBuilder] = {
+    "canvas_index": build_canvas_index_target,
+    "canvas_id_template": build_canvas_id_template_target,
+    "image_api_template": build_url_template_target,
+    "target_url_template": build_url_template_target,
+}
+
+
+def target_builder(rule: IiifRule) -> TargetBuilder:
+    return TARGET_BUILDERS.get(rule.target_rule, build_unsupported_target)
+
+
+# (rule, manifest info, canvas ids or None, target builder) for one edition
+EditionSetup = Tuple[IiifRule, ManifestInfo, Optional[Tuple[str, ...]], TargetBuilder]
+
+
+def edition_setup(
+    edition_id: str,
+    rules: Dict[str, IiifRule],
+    manifests: Dict[str, ManifestInfo],
+    manifest_dir: Path,
+) -> Optional[EditionSetup]:
+    rule = rules.get(edition_id)
+    if rule is None:
+        return None
+    manifest_info = manifests.get(edition_id) or ManifestInfo(edition_id, "", "provisional", "")
+    manifest = load_manifest(manifest_dir / f"{edition_id}.json")
+    canvases = extract_canvas_ids(manifest) if manifest else None
+    return rule, manifest_info, canvases, target_builder(rule)
 
 
 def build_maps(
@@ -304,37 +541,50 @@ def build_maps(
     manifest_dir: Path,
     out_dir: Path,
 ) -> None:
-    citations = read_csv(citations_csv)
+    citations = iter_csv_rows(citations_csv)
+    header = next(citations, [])
+    col = {name: i for i, name in enumerate(header)}
+    edition_col = col.get("edition_id")
     manifests = load_manifests(manifests_csv)
     rules = load_rules(rules_csv) if rules_csv.exists() else {}
 
-    map_rows: List[Dict[str, str]] = []
+    # First target per (edition_id, citation_ref); keys seen more than once
+    # also collect every target they were given, for the ambiguity queue.
+    seen: Dict[Tuple[str, str], MapRow] = {}
+    duplicate_targets: Dict[Tuple[str, str], Set[str]] = {}
     missing_iiif: List[Dict[str, str]] = []
     ambiguous: List[Dict[str, str]] = []
     bad_rows: List[Dict[str, str]] = []
-
-    for citation in citations:
-        edition_id = citation.get("edition_id", "")
-        citation_ref = citation.get("citation_ref", "")
-        rule = rules.get(edition_id)
-        if rule is None:
+    # Everything a citation needs from its edition (rule, manifest info,
+    # canvas ids and target builder), resolved on the edition's first
+    # citation; None for editions without an IIIF rule.
+    setups: Dict[str, Optional[EditionSetup]] = {}
+
+    for row in citations:
+        edition_id = cell(row, edition_col)
+        setup = setups.get(edition_id, MISSING)
+        if setup is MISSING:
+            setup = setups[edition_id] = edition_setup(edition_id, rules, manifests, manifest_dir)
+        if setup is None:
+            # Most citations belong to TEI editions without an IIIF rule;
+            # settle those from their cells, without building a dict.
             if edition_id in NON_TEI_IN_SCOPE:
                 missing_iiif.append({
                     "edition_id": edition_id,
-                    "citation_ref": citation_ref,
+                    "citation_ref": cell(row, col.get("citation_ref")),
                     "reason": "missing_iiif_rule",
                     "citation_key_field": "",
                     "citation_key_value": "",
-                    "source_file": citation.get("source_file", ""),
-                    "source_row": citation.get("source_row", ""),
+                    "source_file": cell(row, col.get("source_file")),
+                    "source_row": cell(row, col.get("source_row")),
                 })
             continue
 
-        manifest_info = manifests.get(edition_id, ManifestInfo(edition_id, "", "provisional", ""))
-        manifest_path = manifest_dir / f"{edition_id}.json"
-        manifest = load_manifest(manifest_path)
+        rule, manifest_info, canvases, build = setup
+        citation = row_to_dict(header, row)
+        citation_ref = citation.get("citation_ref", "")
 
-        target, err = build_target(citation, rule, manifest_info, manifest)
+        target, err = build(citation, rule, manifest_info, canvases)
         if err:
             missing_iiif.append({
                 "edition_id": edition_id,
@@ -355,30 +605,30 @@ def build_maps(
                 "source_row": citation.get("source_row", ""),
             })
             continue
-        map_rows.append(target)
-
-    # detect ambiguous duplicates
-    seen: Dict[Tuple[str, str], List[Dict[str, str]]] = {}
-    for row in map_rows:
-        key = (row["edition_id"], row["citation_ref"])
-        seen.setdefault(key, []).append(row)
-
-    final_rows: List[Dict[str, str]] = []
-    for key, items in seen.items():
-        if len(items) == 1:
-            final_rows.append(items[0])
-            continue
-        targets = ";".join(sorted({i.get("canvas_id", "") or i.get("target_url", "") for i in items}))
+        key = (target[0], target[1])
+        first = seen.setdefault(key, target)
+        if first is not target:
+            targets = duplicate_targets.get(key)
+            if targets is None:
+                targets = duplicate_targets[key] = {first[3] or first[6]}
+            targets.add(target[3] or target[6])
+
+    # Unique keys go straight to the map; the (rare) duplicates are read
+    # from their own, much smaller, dict.
+    final_rows: List[MapRow] = [
+        row for key, row in seen.items() if key not in duplicate_targets
+    ]
+    for key, targets in duplicate_targets.items():
         ambiguous.append({
             "edition_id": key[0],
             "citation_ref": key[1],
             "reason": "multiple_targets",
-            "targets": targets,
+            "targets": ";".join(sorted(targets)),
         })
 
-    final_rows.sort(key=lambda r: (r.get("edition_id", ""), r.get("citation_ref", "")))
+    final_rows.sort(key=MAP_ROW_KEY)
 
-    write_csv(out_dir / "citation_iiif_map.csv", CITATION_IIIF_HEADER, final_rows)
+    write_csv_rows(out_dir / "citation_iiif_map.csv", CITATION_IIIF_HEADER, final_rows)
 
     # needs_review_missing_manifest: all provisional manifests
     missing_manifest: List[Dict[str, str]] = []
@@ -391,10 +641,10 @@ def build_maps(
                 "status": info.status,
             })
 
-    missing_manifest.sort(key=lambda r: r.get("edition_id", ""))
-    missing_iiif.sort(key=lambda r: (r.get("edition_id", ""), r.get("citation_ref", "")))
-    ambiguous.sort(key=lambda r: (r.get("edition_id", ""), r.get("citation_ref", "")))
-    bad_rows.sort(key=lambda r: (r.get("edition_id", ""), r.get("citation_ref", "")))
+    missing_manifest.sort(key=EDITION_KEY)
+    missing_iiif.sort(key=EDITION_CITATION_KEY)
+    ambiguous.sort(key=EDITION_CITATION_KEY)
+    bad_rows.sort(key=EDITION_CITATION_KEY)
 
     write_csv(out_dir / "needs_review_missing_manifest.csv", MISSING_MANIFEST_HEADER, missing_manifest)
     write_csv(out_dir / "needs_review_missing_iiif.csv", MISSING_IIIF_HEADER, missing_iiif)
@@ -402,7 +652,7 @@ def build_maps(
     write_csv(out_dir / "needs_review_bad_rows.csv", BAD_ROWS_HEADER, bad_rows)
 
 
-def main() -> int:
+def main(argv: Optional[List[str]] = None) -> int:
     parser = argparse.ArgumentParser(description="Build citation_iiif_map.csv and needs_review queues")
     parser.add_argument("--in-dir", default="data/vnext", help="Input directory for vnext artifacts")
     parser.add_argument("--out-dir", default="data/vnext", help="Output directory")
@@ -411,7 +661,7 @@ def main() -> int:
         default="data/vnext/iiif/manifests",
         help="Directory for cached IIIF manifests",
     )
-    args = parser.parse_args()
+    args = parser.parse_args(argv)
 
     in_dir = Path(args.in_dir)
     out_dir = Path(args.out_dir)
@@ -8,12 +8,17 @@ from __future__ import annotations
 
 import argparse
 import csv
+import functools
 import json
+import operator
 import os
 import re
+import sys
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
 from dataclasses import dataclass
 from pathlib import Path
-from typing import Dict, Iterable, List, Optional, Tuple
+from typing import Dict, Iterator, List, Optional, Tuple
 
 
 CITATIONS_HEADER = [
@@ -36,8 +41,26 @@ CITATIONS_HEADER = [
     "extra_json",
 ]
 
+CITATION_FIELDS = operator.itemgetter(*CITATIONS_HEADER)
+
 
 ROMAN_RE = re.compile(r"\b[IVXLCDM]+\b", re.IGNORECASE)
+ROMAN_VALUES = {"I": 1, "V": 5, "X": 10, "L": 50, "C": 100, "D": 500, "M": 1000}
+ROMAN_PREFIX_RE = re.compile(r"^(CAP\.?|CHAP\.?|CAPIT\.?|CAPITUL\.?|LIB\.?|LIBER)\s+")
+PAGE_RV_RE = re.compile(r"^(\d+)([rv])$")
+WHITESPACE_RE = re.compile(r"\s+")
+
+# Worker processes only pay for their startup on inputs at least this large;
+# the current revised_ed set (under 1 MiB) is parsed serially.
+PARALLEL_MIN_FILES = 4
+PARALLEL_MIN_BYTES = 8 << 20
+
+# json.dumps builds a new encoder whenever it is given options; share one
+EXTRA_JSON_ENCODER = json.JSONEncoder(sort_keys=True, separators=(",", ":"))
+
+# Files are read and written through 1 MiB buffers, for fewer syscalls
+READ_BUFFER_SIZE = 1 << 20
+WRITE_BUFFER_SIZE = 1 << 20
 
 
 @dataclass
@@ -183,12 +206,14 @@ SOURCE_CONFIGS: Dict[str, SourceConfig] = {
 }
 
 
+@functools.lru_cache(maxsize=None)
 def normalize_ref_component(value: str) -> str:
-    cleaned = re.sub(r"\s+", "_", value.strip())
+    cleaned = WHITESPACE_RE.sub("_", value.strip())
     cleaned = cleaned.replace("|", "/")
     return cleaned
 
 
+@functools.lru_cache(maxsize=None)
 def parse_int(value: Optional[str]) -> Optional[int]:
     if value is None:
         return None
@@ -203,6 +228,7 @@ def parse_int(value: Optional[str]) -> Optional[int]:
     return None
 
 
+@functools.lru_cache(maxsize=None)
 def parse_roman(value: Optional[str]) -> Optional[int]:
     if not value:
         return None
@@ -210,18 +236,21 @@ def parse_roman(value: Optional[str]) -> Optional[int]:
     if not v:
         return None
     # Strip common prefixes like "CAP." or "CHAP."
-    v = re.sub(r"^(CAP\.?|CHAP\.?|CAPIT\.?|CAPITUL\.?|LIB\.?|LIBER)\s+", "", v)
+    v = ROMAN_PREFIX_RE.sub("", v)
     match = ROMAN_RE.search(v)
     if not match:
         return None
-    roman = match.group(0)
+    return roman_value(match.group(0))
+
+
+@functools.lru_cache(maxsize=None)
+def roman_value(roman: str) -> Optional[int]:
     if roman == "IIII":
         return 4
-    values = {"I": 1, "V": 5, "X": 10, "L": 50, "C": 100, "D": 500, "M": 1000}
     total = 0
     prev = 0
     for ch in reversed(roman):
-        val = values.get(ch)
+        val = ROMAN_VALUES.get(ch)
         if val is None:
             return None
         if val < prev:
@@ -232,13 +261,23 @@ def parse_roman(value: Optional[str]) -> Optional[int]:
     return total
 
 
+@functools.lru_cache(maxsize=None)
+def label_number(label: str) -> Optional[str]:
+    """Book/chapter number of a label such as "3", "III" or "Cap. IV", as text."""
+    parsed = parse_int(label)
+    if parsed is None:
+        parsed = parse_roman(label)
+    return str(parsed) if parsed is not None else None
+
+
+@functools.lru_cache(maxsize=None)
 def page_label_sort_key(label: Optional[str]) -> Tuple[int, int, int, str]:
     if not label:
         return (2, 0, 0, "")
     v = label.strip().lower()
     if v.isdigit():
         return (0, int(v), 0, v)
-    m = re.match(r"^(\d+)([rv])$", v)
+    m = PAGE_RV_RE.match(v)
     if m:
         num = int(m.group(1))
         side = 0 if m.group(2) == "r" else 1
@@ -282,94 +321,112 @@ def build_citation_ref(row: Dict[str, Optional[str]], source_row: int) -> str:
     return "|".join(components)
 
 
-def read_tsv_rows(path: Path, config: SourceConfig) -> Iterable[Tuple[Dict[str, str], int]]:
-    with path.open("r", encoding="utf-8", newline="") as f:
+def iter_tsv_rows(path: Path, config: SourceConfig) -> Iterator[Tuple[List[str], List[str], int]]:
+    """Yield (headers, values, row_num) for each data row of a revised_ed TSV.
+
+    values are the raw cells, positionally; row_num follows each header
+    mode's numbering. The same headers list is yielded with every row.
+    """
+    with path.open("r", encoding="utf-8", newline="", buffering=READ_BUFFER_SIZE) as f:
         if config.header_mode == "space_header":
             header_line = f.readline()
             if not header_line:
                 return
             headers = header_line.strip().split()
-            reader = csv.reader(f, delimiter="\t")
             row_num = 1
-            for row in reader:
-                row_num += 1
-                if not row:
-                    continue
-                data = {headers[i]: row[i] if i < len(row) else "" for i in range(len(headers))}
-                yield data, row_num
-            return
-
-        if config.header_mode == "no_header":
+        elif config.header_mode == "no_header":
             headers = config.headers or []
-            reader = csv.reader(f, delimiter="\t")
             row_num = 0
+        else:
+            headers = []
+            row_num = 1
+
+        reader = csv.reader(f, delimiter="\t")
+        if config.header_mode == "normal":
+            # The first non-blank row is the header; blank rows are skipped and
+            # do not count towards row numbers.
+            for row in reader:
+                if row:
+                    headers = row
+                    break
             for row in reader:
-                row_num += 1
-                if not row:
-                    continue
-                data = {headers[i]: row[i] if i < len(row) else "" for i in range(len(headers))}
-                yield data, row_num
+                if row:
+                    row_num += 1
+                    yield headers, row, row_num
             return
 
-        # normal header
-        reader = csv.DictReader(f, delimiter="\t")
-        row_num = 1
         for row in reader:
             row_num += 1
             if not row:
                 continue
-            yield row, row_num
+            yield headers, row, row_num
+
+
+@dataclass(frozen=True)
+class RowPlan:
+    # (column index, citation field) for mapped columns, and
+    # (column index, source key) for columns kept in extra_json
+    targets: Tuple[Tuple[int, str], ...]
+    extras: Tuple[Tuple[int, str], ...]
+
+
+def compile_row_plan(headers: List[str], config: SourceConfig) -> RowPlan:
+    """Work out once per file where each column of a row goes."""
+    # Like a dict built from the row, a repeated header name keeps its
+    # last column, in the position of its first.
+    index = {name: i for i, name in enumerate(headers)}
+    targets: List[Tuple[int, str]] = []
+    extras: List[Tuple[int, str]] = []
+    for name in dict.fromkeys(headers):
+        target = config.column_map.get(name)
+        if target is None or target == "extra_json":
+            extras.append((index[name], name))
+        else:
+            targets.append((index[name], target))
+    return RowPlan(tuple(targets), tuple(extras))
 
 
 def normalize_row(
-    raw_row: Dict[str, str],
+    values: List[str],
     source_row: int,
     source_file: str,
     config: SourceConfig,
+    plan: RowPlan,
 ) -> Dict[str, Optional[str]]:
-    row: Dict[str, Optional[str]] = {k: None for k in CITATIONS_HEADER}
+    row: Dict[str, Optional[str]] = dict.fromkeys(CITATIONS_HEADER)
     row["edition_id"] = config.edition_id
     row["source_file"] = source_file
     row["source_row"] = str(source_row)
 
-    extra: Dict[str, str] = {}
-
-    for src_key, value in raw_row.items():
-        if value is None:
-            continue
-        value = value.strip()
-        if src_key in config.column_map:
-            target = config.column_map[src_key]
-            if target == "extra_json":
-                if value:
-                    extra[src_key] = value
-                continue
-            if target in ("book_num", "chapter_num"):
-                num = parse_int(value)
-                row[target] = str(num) if num is not None else value or None
-            else:
-                row[target] = value or None
+    width = len(values)
+    for i, target in plan.targets:
+        value = values[i].strip() if i < width else ""
+        if target in ("book_num", "chapter_num"):
+            num = parse_int(value)
+            row[target] = str(num) if num is not None else value or None
         else:
+            row[target] = value or None
+
+    extra: Dict[str, str] = {}
+    for i, src_key in plan.extras:
+        if i < width:
+            value = values[i].strip()
             if value:
                 extra[src_key] = value
 
     # Derive book/chapter numbers from labels when possible
-    if not row.get("book_num") and row.get("book_label"):
-        parsed = parse_int(row.get("book_label"))
-        if parsed is None:
-            parsed = parse_roman(row.get("book_label"))
-        if parsed is not None:
-            row["book_num"] = str(parsed)
-    if not row.get("chapter_num") and row.get("chapter_label"):
-        parsed = parse_int(row.get("chapter_label"))
-        if parsed is None:
-            parsed = parse_roman(row.get("chapter_label"))
-        if parsed is not None:
-            row["chapter_num"] = str(parsed)
+    if not row["book_num"] and row["book_label"]:
+        number = label_number(row["book_label"])
+        if number is not None:
+            row["book_num"] = number
+    if not row["chapter_num"] and row["chapter_label"]:
+        number = label_number(row["chapter_label"])
+        if number is not None:
+            row["chapter_num"] = number
 
     # Special parsing for berendes citation_ref (book.chapter)
     if config.citation_ref_source == "berendes_book.chapter":
-        ref = row.get("citation_ref") or ""
+        ref = row["citation_ref"] or ""
         if ref:
             parts = ref.split(".")
             if len(parts) == 2:
@@ -384,49 +441,53 @@ def normalize_row(
     row["citation_ref"] = build_citation_ref(row, source_row)
 
     if extra:
-        row["extra_json"] = json.dumps(extra, sort_keys=True, separators=(",", ":"))
+        row["extra_json"] = EXTRA_JSON_ENCODER.encode(extra)
 
     return row
 
 
 def resolve_citation_ref_collisions(rows: List[Dict[str, Optional[str]]]) -> None:
-    by_key: Dict[Tuple[str, str], List[Dict[str, Optional[str]]]] = {}
-    for row in rows:
-        edition_id = row.get("edition_id") or ""
-        citation_ref = row.get("citation_ref") or ""
-        by_key.setdefault((edition_id, citation_ref), []).append(row)
-
-    for (edition_id, base_ref), group in by_key.items():
-        if len(group) <= 1:
+    keys = [(row.get("edition_id") or "", row.get("citation_ref") or "") for row in rows]
+    counts = Counter(keys)
+    if len(counts) == len(keys):
+        return
+
+    for row, key in zip(rows, keys):
+        if counts[key] <= 1:
             continue
-        for row in group:
-            source_row = row.get("source_row") or ""
-            resolved = f"{base_ref}-r{source_row}"
-            row["citation_ref"] = resolved
-            extra = {}
-            if row.get("extra_json"):
-                try:
-                    extra = json.loads(row["extra_json"])
-                except json.JSONDecodeError:
-                    extra = {"_extra_json_parse_error": row["extra_json"]}
-            extra["citation_ref_collision"] = {"base": base_ref, "resolved": resolved}
-            row["extra_json"] = json.dumps(extra, sort_keys=True, separators=(",", ":"))
+        base_ref = key[1]
+        source_row = row.get("source_row") or ""
+        resolved = f"{base_ref}-r{source_row}"
+        row["citation_ref"] = resolved
+        extra = {}
+        if row.get("extra_json"):
+            try:
+                extra = json.loads(row["extra_json"])
+            except json.JSONDecodeError:
+                extra = {"_extra_json_parse_error": row["extra_json"]}
+        extra["citation_ref_collision"] = {"base": base_ref, "resolved": resolved}
+        row["extra_json"] = EXTRA_JSON_ENCODER.encode(extra)
+
+
+def none_last(value: Optional[str]) -> Tuple[int, str]:
+    if not value:
+        return (1, "")
+    return (0, value)
 
 
-def sort_key(row: Dict[str, Optional[str]]) -> Tuple:
-    def none_last(value: Optional[str]) -> Tuple[int, str]:
-        if value is None or value == "":
-            return (1, "")
-        return (0, value)
-
-    def none_last_num(value: Optional[str]) -> Tuple[int, int]:
-        if value is None or value == "":
-            return (1, 0)
-        try:
-            return (0, int(value))
-        except ValueError:
-            return (0, 0)
+@functools.lru_cache(maxsize=None)
+def none_last_num(value: Optional[str]) -> Tuple[int, int]:
+    if not value:
+        return (1, 0)
+    try:
+        return (0, int(value))
+    except ValueError:
+        return (0, 0)
 
+
+def sort_key(row: Dict[str, Optional[str]]) -> Tuple:
+    # rows.sort() calls this once per row; the numeric parts are memoized
+    # because book and chapter numbers repeat across many rows.
     return (
         row.get("edition_id") or "",
         none_last_num(row.get("book_num")),
@@ -441,59 +502,67 @@ def sort_key(row: Dict[str, Optional[str]]) -> Tuple:
 
 def write_csv(path: Path, rows: List[Dict[str, Optional[str]]]) -> None:
     path.parent.mkdir(parents=True, exist_ok=True)
-    with path.open("w", encoding="utf-8", newline="") as f:
+    with path.open("w", encoding="utf-8", newline="", buffering=WRITE_BUFFER_SIZE) as f:
         writer = csv.writer(f, lineterminator="\n")
         writer.writerow(CITATIONS_HEADER)
-        for row in rows:
-            writer.writerow([
-                row.get("edition_id") or "",
-                row.get("citation_ref") or "",
-                row.get("source_file") or "",
-                row.get("source_row") or "",
-                row.get("book_label") or "",
-                row.get("book_num") or "",
-                row.get("chapter_label") or "",
-                row.get("chapter_num") or "",
-                row.get("page_label") or "",
-                row.get("scan_id") or "",
-                row.get("iiif_key") or "",
-                row.get("headword") or "",
-                row.get("headword_greek") or "",
-                row.get("headword_latin") or "",
-                row.get("headword_english") or "",
-                row.get("notes") or "",
-                row.get("extra_json") or "",
-            ])
+        # csv.writer writes None as an empty field
+        writer.writerows(map(CITATION_FIELDS, rows))
+
+
+def source_config(path: Path) -> SourceConfig:
+    config = SOURCE_CONFIGS.get(path.name)
+    if config is None:
+        # Interned like the edition_id literals of SOURCE_CONFIGS, so
+        # sort keys of equal editions compare by identity
+        config = SourceConfig(
+            edition_id=sys.intern(path.stem),
+            header_mode="normal",
+            headers=None,
+            column_map={},
+        )
+    return config
+
+
+def build_file_citations(path: Path) -> List[Dict[str, Optional[str]]]:
+    """Normalize the rows of one revised_ed TSV (collisions unresolved)."""
+    config = source_config(path)
+    source_file = f"revised_ed/{path.name}"
+    rows: List[Dict[str, Optional[str]]] = []
+    plan: Optional[RowPlan] = None
+    for headers, values, row_num in iter_tsv_rows(path, config):
+        if plan is None:
+            plan = compile_row_plan(headers, config)
+        rows.append(normalize_row(values, row_num, source_file, config, plan))
+    return rows
 
 
 def build_citations(revised_ed_dir: Path) -> List[Dict[str, Optional[str]]]:
-    rows: List[Dict[str, Optional[str]]] = []
-    for path in sorted(revised_ed_dir.glob("*.tsv")):
-        config = SOURCE_CONFIGS.get(path.name)
-        if config is None:
-            config = SourceConfig(
-                edition_id=path.stem,
-                header_mode="normal",
-                headers=None,
-                column_map={},
-            )
-        if config.skip:
-            continue
-        source_file = f"revised_ed/{path.name}"
-        for raw_row, row_num in read_tsv_rows(path, config):
-            row = normalize_row(raw_row, row_num, source_file, config)
-            rows.append(row)
+    paths = [p for p in sorted(revised_ed_dir.glob("*.tsv")) if not source_config(p).skip]
+
+    # Files are independent until collisions are resolved, so large inputs
+    # are normalized in worker processes; map() keeps the file order.
+    workers = min(len(paths), os.cpu_count() or 1)
+    if (
+        workers > 1
+        and len(paths) >= PARALLEL_MIN_FILES
+        and sum(p.stat().st_size for p in paths) >= PARALLEL_MIN_BYTES
+    ):
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            per_file = list(pool.map(build_file_citations, paths))
+    else:
+        per_file = [build_file_citations(p) for p in paths]
+    rows = [row for file_rows in per_file for row in file_rows]
 
     resolve_citation_ref_collisions(rows)
     rows.sort(key=sort_key)
     return rows
 
 
-def main() -> int:
+def main(argv: Optional[List[str]] = None) -> int:
     parser = argparse.ArgumentParser(description="Build data/vnext/citations.csv from revised_ed/*.tsv")
     parser.add_argument("--revised-ed-dir", default="revised_ed", help="Input directory for revised_ed TSVs")
     parser.add_argument("--out-dir", default="data/vnext", help="Output directory")
-    args = parser.parse_args()
+    args = parser.parse_args(argv)
 
     revised_ed_dir = Path(args.revised_ed_dir)
     out_dir = Path(args.out_dir)
@@ -5,12 +5,17 @@ from __future__ import annotations
 
 import argparse
 import csv
+from collections import Counter, defaultdict
 from pathlib import Path
-from typing import Dict, List, Optional, Set, Tuple
+from typing import Dict, Iterator, List, Optional, Set, Tuple
 
 
 NON_TEI_IN_SCOPE = ["barbaro", "desmoulins", "lusitanus", "ruellius", "wechel"]
 
+# Files are read and written through 1 MiB buffers, for fewer syscalls
+READ_BUFFER_SIZE = 1 << 20
+WRITE_BUFFER_SIZE = 1 << 20
+
 MISSING_IIIF_HEADER = [
     "edition_id",
     "citation_ref",
@@ -63,19 +68,27 @@ IIIF_MANIFEST_REQUIRED = {
 }
 
 
-def read_csv(path: Path) -> List[Dict[str, str]]:
-    with path.open("r", encoding="utf-8", newline="") as f:
-        reader = csv.DictReader(f)
-        return [row for row in reader]
+def iter_csv(path: Path) -> Iterator[Dict[str, str]]:
+    with path.open("r", encoding="utf-8", newline="", buffering=READ_BUFFER_SIZE) as f:
+        yield from csv.DictReader(f)
+
+
+def missing_columns_row(label: str, missing_cols: Set[str]) -> Dict[str, str]:
+    return {
+        "edition_id": "",
+        "citation_ref": "",
+        "reason": f"{label}_missing_columns:{','.join(sorted(missing_cols))}",
+        "source_file": "",
+        "source_row": "",
+    }
 
 
 def write_csv(path: Path, header: List[str], rows: List[Dict[str, str]]) -> None:
     path.parent.mkdir(parents=True, exist_ok=True)
-    with path.open("w", encoding="utf-8", newline="") as f:
+    with path.open("w", encoding="utf-8", newline="", buffering=WRITE_BUFFER_SIZE) as f:
         writer = csv.writer(f, lineterminator="\n")
         writer.writerow(header)
-        for row in rows:
-            writer.writerow([row.get(h, "") for h in header])
+        writer.writerows([[row.get(h, "") for h in header] for row in rows])
 
 
 def validate(
@@ -84,62 +97,114 @@ def validate(
     iiif_map_csv: Path,
     out_dir: Path,
 ) -> None:
-    citations = read_csv(citations_csv)
-    manifests = read_csv(manifests_csv)
-    iiif_map = read_csv(iiif_map_csv)
-
-    bad_rows: List[Dict[str, str]] = []
     missing_iiif: List[Dict[str, str]] = []
     missing_manifest: List[Dict[str, str]] = []
     ambiguous: List[Dict[str, str]] = []
 
-    # Required columns checks
-    if citations:
-        missing_cols = CITATIONS_REQUIRED - set(citations[0].keys())
+    # Each input is streamed once: manifests, then the IIIF map, then the
+    # citations, which are checked against the map as they are read.
+    # Required columns are checked on the first row; a missing column is
+    # then read as empty, so the checks can index required columns directly.
+    # Bad rows are collected per source and joined in the original order,
+    # which the stable sort below keeps for rows with equal keys.
+    column_bad_rows: List[Dict[str, str]] = [{}, {}, {}]
+    manifest_bad_rows: List[Dict[str, str]] = []
+    map_bad_rows: List[Dict[str, str]] = []
+
+    manifests_count = 0
+    missing_cols: Set[str] = set()
+    # Status of each edition's first manifest row
+    manifest_status_by_edition: Dict[str, str] = {}
+    for row in iter_csv(manifests_csv):
+        if not manifests_count:
+            missing_cols = IIIF_MANIFEST_REQUIRED - row.keys()
+            if missing_cols:
+                column_bad_rows[2] = missing_columns_row("iiif_manifests", missing_cols)
+        manifests_count += 1
         if missing_cols:
-            bad_rows.append({
-                "edition_id": "",
-                "citation_ref": "",
-                "reason": f"citations_missing_columns:{','.join(sorted(missing_cols))}",
-                "source_file": "",
-                "source_row": "",
+            row.update(dict.fromkeys(missing_cols, ""))
+
+        edition_id = row["edition_id"]
+        status = row["status"]
+        manifest_status_by_edition.setdefault(edition_id, status)
+        # Missing manifest for provisional editions
+        if status == "provisional":
+            missing_manifest.append({
+                "edition_id": edition_id,
+                "reason": row.get("why_provisional", ""),
+                "manifest_url": row.get("manifest_url", ""),
+                "status": status,
             })
-    if iiif_map:
-        missing_cols = CITATION_IIIF_REQUIRED - set(iiif_map[0].keys())
-        if missing_cols:
-            bad_rows.append({
-                "edition_id": "",
+        if status == "manifest_backed" and not row.get("manifest_url"):
+            manifest_bad_rows.append({
+                "edition_id": edition_id,
                 "citation_ref": "",
-                "reason": f"iiif_map_missing_columns:{','.join(sorted(missing_cols))}",
-                "source_file": "",
+                "reason": "manifest_backed_missing_manifest_url",
+                "source_file": "iiif_manifests.csv",
                 "source_row": "",
             })
-    if manifests:
-        missing_cols = IIIF_MANIFEST_REQUIRED - set(manifests[0].keys())
-        if missing_cols:
-            bad_rows.append({
-                "edition_id": "",
+        if status == "provisional" and not row.get("why_provisional"):
+            manifest_bad_rows.append({
+                "edition_id": edition_id,
                 "citation_ref": "",
-                "reason": f"iiif_manifests_missing_columns:{','.join(sorted(missing_cols))}",
-                "source_file": "",
+                "reason": "provisional_missing_why_provisional",
+                "source_file": "iiif_manifests.csv",
                 "source_row": "",
             })
 
-    # Build lookup sets
-    citations_by_edition: Dict[str, List[Dict[str, str]]] = {}
-    for row in citations:
-        citations_by_edition.setdefault(row.get("edition_id", ""), []).append(row)
-
-    iiif_keys: Dict[Tuple[str, str], List[Dict[str, str]]] = {}
-    for row in iiif_map:
-        key = (row.get("edition_id", ""), row.get("citation_ref", ""))
-        iiif_keys.setdefault(key, []).append(row)
+    iiif_map_count = 0
+    missing_cols = set()
+    iiif_keys: Dict[Tuple[str, str], List[Dict[str, str]]] = defaultdict(list)
+    for row in iter_csv(iiif_map_csv):
+        if not iiif_map_count:
+            missing_cols = CITATION_IIIF_REQUIRED - row.keys()
+            if missing_cols:
+                column_bad_rows[1] = missing_columns_row("iiif_map", missing_cols)
+        iiif_map_count += 1
+        if missing_cols:
+            row.update(dict.fromkeys(missing_cols, ""))
+        key = (row["edition_id"], row["citation_ref"])
+        iiif_keys[key].append(row)
+
+    citations_count = 0
+    missing_cols = set()
+    citation_keys: Set[Tuple[str, str]] = set()
+    # Citations and mapped citations per non-TEI edition in scope
+    coverage_total: Counter = Counter()
+    coverage_mapped: Counter = Counter()
+    in_scope = set(NON_TEI_IN_SCOPE)
+    for row in iter_csv(citations_csv):
+        if not citations_count:
+            missing_cols = CITATIONS_REQUIRED - row.keys()
+            if missing_cols:
+                column_bad_rows[0] = missing_columns_row("citations", missing_cols)
+        citations_count += 1
+        if missing_cols:
+            row.update(dict.fromkeys(missing_cols, ""))
 
-    citation_keys: Set[Tuple[str, str]] = set(
-        (row.get("edition_id", ""), row.get("citation_ref", "")) for row in citations
-    )
+        edition_id = row["edition_id"]
+        citation_ref = row["citation_ref"]
+        key = (edition_id, citation_ref)
+        citation_keys.add(key)
+        if edition_id not in in_scope:
+            continue
+        coverage_total[edition_id] += 1
+        if key in iiif_keys:
+            coverage_mapped[edition_id] += 1
+        else:
+            # Missing IIIF for non-TEI editions in scope
+            missing_iiif.append({
+                "edition_id": edition_id,
+                "citation_ref": citation_ref,
+                "reason": "missing_iiif_target",
+                "citation_key_field": "",
+                "citation_key_value": "",
+                "source_file": row["source_file"],
+                "source_row": row["source_row"],
+            })
 
-    # Ambiguous detection
+    # Ambiguous detection, and iiif_map rows against citations + status
+    # correctness (rows sharing a key keep their file order)
     for key, rows in iiif_keys.items():
         if len(rows) > 1:
             targets = ";".join(sorted({r.get("canvas_id", "") or r.get("target_url", "") for r in rows}))
@@ -149,75 +214,30 @@ def validate(
                 "reason": "multiple_targets",
                 "targets": targets,
             })
-
-    # Missing IIIF for non-TEI editions in scope (only if citations present)
-    for edition_id in NON_TEI_IN_SCOPE:
-        edition_citations = citations_by_edition.get(edition_id, [])
-        if not edition_citations:
-            continue
-        for row in edition_citations:
-            key = (edition_id, row.get("citation_ref", ""))
-            if key not in iiif_keys:
-                missing_iiif.append({
-                    "edition_id": edition_id,
-                    "citation_ref": row.get("citation_ref", ""),
-                    "reason": "missing_iiif_target",
-                    "citation_key_field": "",
-                    "citation_key_value": "",
-                    "source_file": row.get("source_file", ""),
-                    "source_row": row.get("source_row", ""),
+        cited = key in citation_keys
+        for row in rows:
+            if not cited:
+                map_bad_rows.append({
+                    "edition_id": row["edition_id"],
+                    "citation_ref": row["citation_ref"],
+                    "reason": "iiif_map_missing_citation",
+                    "source_file": "citation_iiif_map.csv",
+                    "source_row": "",
+                })
+            if row["status"] == "manifest_backed" and not row.get("manifest_url"):
+                map_bad_rows.append({
+                    "edition_id": row["edition_id"],
+                    "citation_ref": row["citation_ref"],
+                    "reason": "iiif_map_manifest_backed_missing_manifest_url",
+                    "source_file": "citation_iiif_map.csv",
+                    "source_row": "",
                 })
 
-    # Missing manifest for provisional editions
-    for row in manifests:
-        if row.get("status") == "provisional":
-            missing_manifest.append({
-                "edition_id": row.get("edition_id", ""),
-                "reason": row.get("why_provisional", ""),
-                "manifest_url": row.get("manifest_url", ""),
-                "status": row.get("status", ""),
-            })
-        if row.get("status") == "manifest_backed" and not row.get("manifest_url"):
-            bad_rows.append({
-                "edition_id": row.get("edition_id", ""),
-                "citation_ref": "",
-                "reason": "manifest_backed_missing_manifest_url",
-                "source_file": "iiif_manifests.csv",
-                "source_row": "",
-            })
-        if row.get("status") == "provisional" and not row.get("why_provisional"):
-            bad_rows.append({
-                "edition_id": row.get("edition_id", ""),
-                "citation_ref": "",
-                "reason": "provisional_missing_why_provisional",
-                "source_file": "iiif_manifests.csv",
-                "source_row": "",
-            })
-
-    # Check iiif_map rows against citations + status correctness
-    for row in iiif_map:
-        key = (row.get("edition_id", ""), row.get("citation_ref", ""))
-        if key not in citation_keys:
-            bad_rows.append({
-                "edition_id": row.get("edition_id", ""),
-                "citation_ref": row.get("citation_ref", ""),
-                "reason": "iiif_map_missing_citation",
-                "source_file": "citation_iiif_map.csv",
-                "source_row": "",
-            })
-        if row.get("status") == "manifest_backed" and not row.get("manifest_url"):
-            bad_rows.append({
-                "edition_id": row.get("edition_id", ""),
-                "citation_ref": row.get("citation_ref", ""),
-                "reason": "iiif_map_manifest_backed_missing_manifest_url",
-                "source_file": "citation_iiif_map.csv",
-                "source_row": "",
-            })
-
-    missing_iiif.sort(key=lambda r: (r.get("edition_id", ""), r.get("citation_ref", "")))
-    missing_manifest.sort(key=lambda r: r.get("edition_id", ""))
-    ambiguous.sort(key=lambda r: (r.get("edition_id", ""), r.get("citation_ref", "")))
-    bad_rows.sort(key=lambda r: (r.get("edition_id", ""), r.get("citation_ref", "")))
+    bad_rows = [r for r in column_bad_rows if r] + manifest_bad_rows + map_bad_rows
+    missing_iiif.sort(key=lambda r: (r["edition_id"], r["citation_ref"]))
+    missing_manifest.sort(key=lambda r: r["edition_id"])
+    ambiguous.sort(key=lambda r: (r["edition_id"], r["citation_ref"]))
+    bad_rows.sort(key=lambda r: (r["edition_id"], r["citation_ref"]))
 
     write_csv(out_dir / "needs_review_missing_iiif.csv", MISSING_IIIF_HEADER, missing_iiif)
     write_csv(out_dir / "needs_review_missing_manifest.csv", MISSING_MANIFEST_HEADER, missing_manifest)
@@ -229,19 +249,18 @@ def validate(
     report_lines.append("# Phase 1 Validation Report")
     report_lines.append("")
     report_lines.append("Inputs:")
-    report_lines.append(f"- citations.csv: {len(citations)} rows")
-    report_lines.append(f"- citation_iiif_map.csv: {len(iiif_map)} rows")
-    report_lines.append(f"- iiif_manifests.csv: {len(manifests)} rows")
+    report_lines.append(f"- citations.csv: {citations_count} rows")
+    report_lines.append(f"- citation_iiif_map.csv: {iiif_map_count} rows")
+    report_lines.append(f"- iiif_manifests.csv: {manifests_count} rows")
     report_lines.append("")
     report_lines.append("Coverage (non-TEI editions in scope):")
     for edition_id in NON_TEI_IN_SCOPE:
-        edition_citations = citations_by_edition.get(edition_id, [])
-        if not edition_citations:
+        if edition_id not in coverage_total:
             continue
-        total = len(edition_citations)
-        mapped = sum(1 for row in edition_citations if (edition_id, row.get("citation_ref", "")) in iiif_keys)
+        total = coverage_total[edition_id]
+        mapped = coverage_mapped[edition_id]
         pct = 0 if total == 0 else int(round(mapped * 100 / total))
-        status = next((m.get("status", "") for m in manifests if m.get("edition_id") == edition_id), "")
+        status = manifest_status_by_edition.get(edition_id, "")
         report_lines.append(f"- {edition_id}: {mapped}/{total} ({pct}%) status={status}")
     report_lines.append("")
     report_lines.append("Provisional manifests:")
@@ -260,11 +279,11 @@ def validate(
     (out_dir / "validation_report.md").write_text("\n".join(report_lines) + "\n", encoding="utf-8")
 
 
-def main() -> int:
+def main(argv: Optional[List[str]] = None) -> int:
     parser = argparse.ArgumentParser(description="Validate Phase 1 outputs")
     parser.add_argument("--in-dir", default="data/vnext", help="Input directory for vnext artifacts")
     parser.add_argument("--out-dir", default="data/vnext", help="Output directory")
-    args = parser.parse_args()
+    args = parser.parse_args(argv)
 
     in_dir = Path(args.in_dir)
     out_dir = Path(args.out_dir)
@@ -0,0 +1,81 @@
+import contextlib
+import io
+import shutil
+import sqlite3
+import sys
+import tempfile
+import unittest
+from pathlib import Path
+
+# Allow importing scripts as modules
+ROOT = Path(__file__).resolve().parents[1]
+SCRIPTS = ROOT / "scripts"
+sys.path.insert(0, str(SCRIPTS))
+
+import build_db
+import import_csv
+import migrate_db
+
+
+def table_contents(db_path: Path):
+    conn = sqlite3.connect(db_path)
+    try:
+        return {
+            table: sorted(conn.execute(f"SELECT * FROM {table}").fetchall(), key=repr)
+            for table in import_csv.TABLE_COLUMNS
+        }
+    finally:
+        conn.close()
+
+
+class TestBuildDb(unittest.TestCase):
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.tmpdir = Path(tmp.name)
+
+    def test_csv_value(self):
+        self.assertEqual(build_db.csv_value("barbaro:II\r"), "barbaro:II\n")
+        self.assertEqual(build_db.csv_value("a\r\nb\rc\nd"), "a\nb\nc\nd")
+        self.assertEqual(build_db.csv_value("plain"), "plain")
+        self.assertIsNone(build_db.csv_value(None))
+        self.assertEqual(build_db.csv_value(3), 3)
+
+    def test_matches_csv_round_trip(self):
+        xml_path = ROOT / "dioscmatmad_db.xml"
+        data_dir = self.tmpdir / "data"
+        data_dir.mkdir()
+        shutil.copy(ROOT / "data" / "editions.csv", data_dir / "editions.csv")
+
+        with contextlib.redirect_stdout(io.StringIO()):
+            migrate_db.migrate(xml_path, data_dir)
+            import_csv.import_data_dir(data_dir, self.tmpdir / "via_csv.db")
+            build_db.build(xml_path, data_dir / "editions.csv", self.tmpdir / "direct.db")
+
+        via_csv = table_contents(self.tmpdir / "via_csv.db")
+        direct = table_contents(self.tmpdir / "direct.db")
+        for table in import_csv.TABLE_COLUMNS:
+            with self.subTest(table=table):
+                self.assertTrue(via_csv[table])
+                self.assertEqual(direct[table], via_csv[table])
+
+    def test_duplicate_link_rows(self):
+        data_dir = self.tmpdir / "data"
+        data_dir.mkdir()
+        (data_dir / "witnesses.csv").write_text(
+            "entry_id,manuscript_id\nwellmann:1.1,ms1\nwellmann:1.1,ms1\nwellmann:1.2,ms1\n",
+            encoding="utf-8",
+        )
+        db_path = self.tmpdir / "dmm.db"
+        db_path.write_bytes(b"previous")
+
+        with contextlib.redirect_stdout(io.StringIO()):
+            with self.assertRaises(SystemExit) as cm:
+                import_csv.import_data_dir(data_dir, db_path)
+        self.assertIn("witnesses: (entry_id='wellmann:1.1', manuscript_id='ms1') occurs 2 times",
+                      str(cm.exception.code))
+        self.assertFalse(db_path.exists())
+
+
+if __name__ == "__main__":
+    unittest.main()
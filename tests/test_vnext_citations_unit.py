@@ -1,6 +1,8 @@
 import sys
 import unittest
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
+from unittest import mock
 
 # Allow importing scripts as modules
 ROOT = Path(__file__).resolve().parents[1]
@@ -14,23 +16,57 @@ class TestCitationsUnit(unittest.TestCase):
     def test_space_header_tsv(self):
         path = ROOT / "tests/fixtures/revised_ed/beck.tsv"
         config = vbc.SOURCE_CONFIGS["beck.tsv"]
-        rows = list(vbc.read_tsv_rows(path, config))
+        rows = list(vbc.iter_tsv_rows(path, config))
         self.assertEqual(len(rows), 2)
-        row, row_num = rows[0]
-        self.assertIn("beck_id", row)
-        self.assertEqual(row["beck_id"], "DMM1001")
+        headers, values, row_num = rows[0]
+        self.assertIn("beck_id", headers)
+        self.assertEqual(values[headers.index("beck_id")], "DMM1001")
         self.assertEqual(row_num, 2)
 
     def test_no_header_tsv(self):
         path = ROOT / "tests/fixtures/revised_ed/wellmann.tsv"
         config = vbc.SOURCE_CONFIGS["wellmann.tsv"]
-        rows = list(vbc.read_tsv_rows(path, config))
+        rows = list(vbc.iter_tsv_rows(path, config))
         self.assertEqual(len(rows), 2)
-        row, row_num = rows[0]
-        self.assertEqual(row.get("book_num"), "1")
-        self.assertEqual(row.get("chapter_num"), "1")
+        headers, values, row_num = rows[0]
+        self.assertEqual(values[headers.index("book_num")], "1")
+        self.assertEqual(values[headers.index("chapter_num")], "1")
         self.assertEqual(row_num, 1)
 
+    def test_row_plan_short_and_surplus_rows(self):
+        config = vbc.SOURCE_CONFIGS["barbaro.tsv"]
+        # barbaro_iiif is missing; "note" is not in the column map
+        headers = ["barbaro_page", "barbaro_term", "note", "barbaro_chapter"]
+        plan = vbc.compile_row_plan(headers, config)
+        self.assertEqual(plan.targets, ((0, "page_label"), (1, "headword"), (3, "chapter_label")))
+        self.assertEqual(plan.extras, ((2, "note"),))
+
+        full = vbc.normalize_row(["1r", " Iris ", "x", "II"], 2, "revised_ed/barbaro.tsv", config, plan)
+        self.assertEqual(full["page_label"], "1r")
+        self.assertEqual(full["headword"], "Iris")
+        self.assertEqual(full["chapter_num"], "2")
+        self.assertIsNone(full["iiif_key"])
+        self.assertEqual(full["extra_json"], '{"note":"x"}')
+
+        short = vbc.normalize_row(["2v", "Acorus"], 3, "revised_ed/barbaro.tsv", config, plan)
+        self.assertEqual(short["headword"], "Acorus")
+        self.assertIsNone(short["chapter_label"])
+        self.assertIsNone(short["chapter_num"])
+        self.assertIsNone(short["extra_json"])
+        self.assertEqual(short["citation_ref"], "p2v")
+        self.assertEqual(short["source_row"], "3")
+
+        # Cells beyond the header are dropped
+        surplus = vbc.normalize_row(["3r", "Meu", "", "I", "stray"], 4, "revised_ed/barbaro.tsv", config, plan)
+        self.assertEqual(surplus["chapter_num"], "1")
+        self.assertIsNone(surplus["extra_json"])
+
+    def test_row_plan_repeated_header(self):
+        config = vbc.SOURCE_CONFIGS["barbaro.tsv"]
+        plan = vbc.compile_row_plan(["barbaro_term", "barbaro_page", "barbaro_term"], config)
+        # The last column wins, in the position of the first
+        self.assertEqual(plan.targets, ((2, "headword"), (1, "page_label")))
+
     def test_roman_parsing(self):
         self.assertEqual(vbc.parse_roman("IIII"), 4)
         self.assertEqual(vbc.parse_roman("Cap. IV"), 4)
@@ -53,6 +89,19 @@ class TestCitationsUnit(unittest.TestCase):
         for row in rows:
             self.assertIn("citation_ref_collision", row.get("extra_json", ""))
 
+    def test_parallel_build_matches_serial(self):
+        revised_ed_dir = ROOT / "tests/fixtures/revised_ed"
+        serial = vbc.build_citations(revised_ed_dir)
+        pool = mock.Mock(wraps=ProcessPoolExecutor)
+        with mock.patch.object(vbc, "PARALLEL_MIN_FILES", 1), \
+                mock.patch.object(vbc, "PARALLEL_MIN_BYTES", 0), \
+                mock.patch.object(vbc.os, "cpu_count", return_value=2), \
+                mock.patch.object(vbc, "ProcessPoolExecutor", pool):
+            parallel = vbc.build_citations(revised_ed_dir)
+        pool.assert_called_once_with(max_workers=2)
+        self.assertTrue(serial)
+        self.assertEqual(parallel, serial)
+
 
 if __name__ == "__main__":
     unittest.main()
@@ -0,0 +1,104 @@
+import sys
+import unittest
+from pathlib import Path
+
+# Allow importing scripts as modules
+ROOT = Path(__file__).resolve().parents[1]
+SCRIPTS = ROOT / "scripts"
+sys.path.insert(0, str(SCRIPTS))
+
+import vnext_build_citation_iiif_map as vbim
+
+CITATION = {
+    "edition_id": "ed",
+    "citation_ref": "ed:1.2",
+    "page": "7",
+    "page_label": "7r",
+    "folio": "12",
+    "word": "abc",
+    "empty": "",
+    "extra_json": '{"leaf": "3", "side": "v"}',
+}
+EXTRA = {"leaf": "3", "side": "v"}
+
+
+def render_general(template, citation, extra, overrides):
+    context = dict(citation)
+    context.update(overrides)
+    return vbim.render_template(template, citation, extra, context)
+
+
+def outcome(render, *args):
+    # render_rule_template maps KeyError and ValueError alike to one error
+    try:
+        return render(*args), None
+    except (KeyError, ValueError):
+        return None, "template_missing_fields"
+
+
+class TestIiifMapUnit(unittest.TestCase):
+    def assert_parity(self, template, citation=CITATION, extra=EXTRA, key_value="42"):
+        compiled = vbim.compile_template(template)
+        self.assertIsNotNone(compiled)
+        overrides = {"citation_key_value": key_value, "citation_key_field": "page"}
+        expected = outcome(render_general, template, citation, extra, overrides)
+        self.assertEqual(outcome(compiled.render, citation, extra, overrides), expected)
+        return expected
+
+    def test_compiled_template_parity(self):
+        cases = {
+            "https://x.org/{edition_id}/canvas/p{page}": ("https://x.org/ed/canvas/p7", None),
+            "f{{4%0%folio}}.jpg": ("f0012.jpg", None),
+            "f{{3%-1%page}}-{{0%2%extra_json.leaf}}{word}": ("f006-5abc", None),
+            "{{{{literal}}}}/{page}": ("{{literal}}/7", None),
+            "{{x}}{{2%0%page}}}}": ("{x}07}", None),
+            "{citation_key_value}/{citation_key_field}": ("42/page", None),
+            "no fields at all": ("no fields at all", None),
+            "{empty}": ("", None),
+            "{missing}": (None, "template_missing_fields"),
+            "{{3%0%missing}}": (None, "template_missing_fields"),
+            "{{3%0%word}}": (None, "template_missing_fields"),
+            "{missing}{{3%0%word}}": (None, "template_missing_fields"),
+        }
+        for template, expected in cases.items():
+            with self.subTest(template=template):
+                self.assertEqual(self.assert_parity(template), expected)
+
+    def test_compiled_template_overrides_citation(self):
+        citation = dict(CITATION, citation_key_value="stale")
+        self.assertEqual(
+            self.assert_parity("{citation_key_value}", citation=citation, key_value="9"),
+            ("9", None),
+        )
+
+    def test_compiled_template_fallbacks(self):
+        for template in ("", "{page!r}", "{page:>4}", "{0}", "{}", "{page.real}",
+                         "{page[0]}", "{page", "page}", "a\0b"):
+            with self.subTest(template=template):
+                self.assertIsNone(vbim.compile_template(template))
+
+    def test_rule_template_parity(self):
+        for template in ("p{page}/{{2%1%extra_json.leaf}}{{{{", "{page!r}", "{missing}"):
+            rule = vbim.IiifRule(
+                edition_id="ed",
+                iiif_kind="presentation",
+                manifest_url="",
+                image_base_url="",
+                citation_key_field="page",
+                target_rule="url_template",
+                target_template=template,
+                canvas_index_base=None,
+                notes="",
+            )
+            compiled = vbim.IiifRule(**dict(
+                rule.__dict__, compiled_template=vbim.compile_template(template)
+            ))
+            with self.subTest(template=template):
+                self.assertEqual(
+                    vbim.render_rule_template(CITATION, compiled, EXTRA, "7"),
+                    vbim.render_rule_template(CITATION, rule, EXTRA, "7"),
+                )
+
+
+if __name__ == "__main__":
+    unittest.main()
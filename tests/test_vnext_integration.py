@@ -1,4 +1,8 @@
+import contextlib
 import hashlib
+import importlib
+import io
+import os
 import shutil
 import subprocess
 import sys
@@ -7,111 +11,139 @@ import unittest
 from pathlib import Path
 
 ROOT = Path(__file__).resolve().parents[1]
+SCRIPTS = ROOT / "scripts"
+sys.path.insert(0, str(SCRIPTS))
+
+EXPECTED_DIR = ROOT / "tests/fixtures/expected/vnext"
+EXPECTED_NAMES = (
+    "citations.csv",
+    "citation_iiif_map.csv",
+    "needs_review_missing_manifest.csv",
+    "needs_review_missing_iiif.csv",
+    "needs_review_ambiguous_iiif.csv",
+    "needs_review_bad_rows.csv",
+    "validation_report.md",
+)
+
+# Test trees go on tmpfs when there is one, so fixture IO stays in RAM;
+# DMM_TEST_TMPFS overrides the location.
+TEST_TMP_DIR = os.environ.get("DMM_TEST_TMPFS", "/dev/shm" if os.path.isdir("/dev/shm") else None)
+
+
+def new_hash():
+    # Only byte equality across runs is checked, so any fast digest will do
+    return hashlib.blake2b(digest_size=16)
 
 
 def file_hash(path: Path) -> str:
-    h = hashlib.sha256()
-    with path.open("rb") as f:
+    if hasattr(hashlib, "file_digest"):  # Python 3.11+: the read loop runs in C
+        with path.open("rb", buffering=0) as f:
+            return hashlib.file_digest(f, new_hash).hexdigest()
+
+    h = new_hash()
+    buf = memoryview(bytearray(1 << 20))
+    with path.open("rb", buffering=0) as f:
         while True:
-            chunk = f.read(8192)
-            if not chunk:
+            n = f.readinto(buf)
+            if not n:
                 break
-            h.update(chunk)
+            h.update(buf[:n])
     return h.hexdigest()
 
 
-class TestPhase1Integration(unittest.TestCase):
-    def setUp(self):
-        self.tmpdir = Path(tempfile.mkdtemp())
-        (self.tmpdir / "revised_ed").mkdir()
-        (self.tmpdir / "data" / "vnext" / "iiif" / "manifests").mkdir(parents=True)
+def link_tree(src: Path, dst: Path) -> None:
+    """Mirror src under dst with hard links, copying where links are unsupported."""
+    for path in sorted(src.rglob("*")):
+        target = dst / path.relative_to(src)
+        if path.is_dir():
+            target.mkdir(parents=True, exist_ok=True)
+            continue
+        target.parent.mkdir(parents=True, exist_ok=True)
+        try:
+            os.link(path, target)
+        except OSError:
+            shutil.copy2(path, target)
 
-        shutil.copytree(ROOT / "tests/fixtures/revised_ed", self.tmpdir / "revised_ed", dirs_exist_ok=True)
-        shutil.copytree(ROOT / "tests/fixtures/vnext", self.tmpdir / "data" / "vnext", dirs_exist_ok=True)
 
-    def tearDown(self):
-        shutil.rmtree(self.tmpdir)
+class TestPhase1Integration(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        # The fixtures are copied once per class; each test then links them
+        # into its own tree. The scripts only create new output files, so
+        # the shared inputs are never written through a link.
+        cls._fixture_cache = Path(tempfile.mkdtemp(dir=TEST_TMP_DIR))
+        cls.addClassCleanup(shutil.rmtree, cls._fixture_cache, ignore_errors=True)
+        (cls._fixture_cache / "revised_ed").mkdir()
+        (cls._fixture_cache / "data" / "vnext" / "iiif" / "manifests").mkdir(parents=True)
+
+        shutil.copytree(ROOT / "tests/fixtures/revised_ed", cls._fixture_cache / "revised_ed", dirs_exist_ok=True)
+        shutil.copytree(ROOT / "tests/fixtures/vnext", cls._fixture_cache / "data" / "vnext", dirs_exist_ok=True)
+
+        # The expected outputs are read once per class
+        cls._expected = {name: (EXPECTED_DIR / name).read_bytes() for name in EXPECTED_NAMES}
 
-    def run_script(self, script: str, args):
-        cmd = [sys.executable, str(ROOT / "scripts" / script)] + args
-        subprocess.check_call(cmd)
+    def setUp(self):
+        self.tmpdir = self.make_tree()
+
+    def make_tree(self) -> Path:
+        """A fresh working tree with the fixtures, removed after the test."""
+        tmp = tempfile.TemporaryDirectory(dir=TEST_TMP_DIR)
+        self.addCleanup(tmp.cleanup)
+        root = Path(tmp.name)
+        link_tree(self._fixture_cache, root)
+        return root
+
+    def run_script(self, script: str, args, hash_seed=None):
+        if hash_seed is not None:
+            # A fresh interpreter with its own hash seed and cold caches
+            env = dict(os.environ, PYTHONHASHSEED=hash_seed)
+            subprocess.run(
+                [sys.executable, str(SCRIPTS / script)] + args,
+                env=env, check=True, stdout=subprocess.DEVNULL,
+            )
+            return
+        # Otherwise scripts run in-process through their main(argv), sparing
+        # an interpreter start per run; imports are cached in sys.modules.
+        module = importlib.import_module(Path(script).stem)
+        with contextlib.redirect_stdout(io.StringIO()):
+            self.assertEqual(module.main(args), 0, script)
+
+    def run_pipeline(self, root: Path, hash_seed=None) -> Path:
+        """Build citations, the IIIF map and the validation queues in a tree.
+
+        With a hash_seed, each script runs in a subprocess under that
+        PYTHONHASHSEED instead of in-process.
+        """
+        vnext_dir = root / "data" / "vnext"
+        manifest_dir = vnext_dir / "iiif" / "manifests"
+        for script, args in [
+            ("vnext_build_citations.py", ["--revised-ed-dir", str(root / "revised_ed")]),
+            ("vnext_build_citation_iiif_map.py", ["--in-dir", str(vnext_dir), "--manifest-dir", str(manifest_dir)]),
+            ("vnext_validate_phase1.py", ["--in-dir", str(vnext_dir)]),
+        ]:
+            self.run_script(script, args + ["--out-dir", str(vnext_dir)], hash_seed)
+        return vnext_dir
 
     def test_end_to_end_build(self):
-        vnext_dir = self.tmpdir / "data" / "vnext"
-        manifest_dir = vnext_dir / "iiif" / "manifests"
+        vnext_dir = self.run_pipeline(self.tmpdir)
 
-        self.run_script(
-            "vnext_build_citations.py",
-            ["--revised-ed-dir", str(self.tmpdir / "revised_ed"), "--out-dir", str(vnext_dir)],
-        )
-        self.run_script(
-            "vnext_build_citation_iiif_map.py",
-            ["--in-dir", str(vnext_dir), "--out-dir", str(vnext_dir), "--manifest-dir", str(manifest_dir)],
-        )
-        self.run_script(
-            "vnext_validate_phase1.py",
-            ["--in-dir", str(vnext_dir), "--out-dir", str(vnext_dir)],
-        )
-
-        expected_dir = ROOT / "tests/fixtures/expected/vnext"
-        for name in [
-            "citations.csv",
-            "citation_iiif_map.csv",
-            "needs_review_missing_manifest.csv",
-            "needs_review_missing_iiif.csv",
-            "needs_review_ambiguous_iiif.csv",
-            "needs_review_bad_rows.csv",
-            "validation_report.md",
-        ]:
+        for name in EXPECTED_NAMES:
             with self.subTest(name=name):
-                actual = (vnext_dir / name).read_bytes()
-                expected = (expected_dir / name).read_bytes()
-                self.assertEqual(actual, expected)
+                actual_path = vnext_dir / name
+                expected = self._expected[name]
+                self.assertEqual(actual_path.read_bytes(), expected)
 
     def test_determinism(self):
-        vnext_dir = self.tmpdir / "data" / "vnext"
-        manifest_dir = vnext_dir / "iiif" / "manifests"
-
-        self.run_script(
-            "vnext_build_citations.py",
-            ["--revised-ed-dir", str(self.tmpdir / "revised_ed"), "--out-dir", str(vnext_dir)],
-        )
-        self.run_script(
-            "vnext_build_citation_iiif_map.py",
-            ["--in-dir", str(vnext_dir), "--out-dir", str(vnext_dir), "--manifest-dir", str(manifest_dir)],
-        )
-        self.run_script(
-            "vnext_validate_phase1.py",
-            ["--in-dir", str(vnext_dir), "--out-dir", str(vnext_dir)],
-        )
-
-        hashes_first = {
-            name: file_hash(vnext_dir / name)
-            for name in [
-                "citations.csv",
-                "citation_iiif_map.csv",
-                "validation_report.md",
-            ]
-        }
-
-        # Run again and compare
-        self.run_script(
-            "vnext_build_citations.py",
-            ["--revised-ed-dir", str(self.tmpdir / "revised_ed"), "--out-dir", str(vnext_dir)],
-        )
-        self.run_script(
-            "vnext_build_citation_iiif_map.py",
-            ["--in-dir", str(vnext_dir), "--out-dir", str(vnext_dir), "--manifest-dir", str(manifest_dir)],
-        )
-        self.run_script(
-            "vnext_validate_phase1.py",
-            ["--in-dir", str(vnext_dir), "--out-dir", str(vnext_dir)],
-        )
-
-        hashes_second = {
-            name: file_hash(vnext_dir / name)
-            for name in hashes_first
-        }
+        # The second run goes through fresh interpreters with a different
+        # hash seed from this process, so output that depends on set/dict
+        # hash order or on warm module caches shows up as a mismatch.
+        hash_seed = "1" if os.environ.get("PYTHONHASHSEED") == "0" else "0"
+        names = ["citations.csv", "citation_iiif_map.csv", "validation_report.md"]
+        first_dir = self.run_pipeline(self.tmpdir)
+        second_dir = self.run_pipeline(self.make_tree(), hash_seed=hash_seed)
+
+        hashes_first = {name: file_hash(first_dir / name) for name in names}
+        hashes_second = {name: file_hash(second_dir / name) for name in names}
         self.assertEqual(hashes_first, hashes_second)
 
 